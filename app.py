@@ -1,16 +1,90 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, UploadFile, File
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.datastructures import Headers
 from pydantic import BaseModel
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+import fcntl
+import functools
+import copy
+import hashlib
+import importlib
+import heapq
+import http.cookiejar
+import io
+import itertools
+import math
+import multiprocessing
+import random
+import re
+import shutil
+import sqlite3
+import socket
+import subprocess
+import threading
+import time
 import yt_dlp
 import os
 import uuid
+import zipfile
 from pathlib import Path
+from urllib.parse import quote, unquote, urlparse
+import aiofiles
+import array
 import asyncio
+import collections
+import contextvars
+import queue
+import sys
+import urllib.request
 from typing import Optional
 import json
 
-app = FastAPI(title="YouTube Downloader API", version="1.0.0")
+# Metrics are aggregated across uvicorn workers through files in this
+# directory, which must be configured before prometheus_client is imported
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/metrics")
+Path(os.environ["PROMETHEUS_MULTIPROC_DIR"]).mkdir(parents=True, exist_ok=True)
+
+def clear_dead_metrics():
+    """Delete the metric files of processes that are gone, left over from earlier runs.
+
+    serve.py empties the directory before it forks; this covers other ways of
+    starting the app without touching the files of workers that are running.
+    """
+    for path in Path(os.environ["PROMETHEUS_MULTIPROC_DIR"]).glob("*.db"):
+        match = re.search(r"_(\d+)\.db$", path.name)
+        if not match:
+            continue
+        try:
+            os.kill(int(match.group(1)), 0)
+        except ProcessLookupError:
+            path.unlink(missing_ok=True)
+        except PermissionError:
+            pass  # someone else's process
+
+clear_dead_metrics()
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start and stop background resources"""
+    job_workers.start()
+    sweeper = asyncio.create_task(storage_sweeper())
+    # Compile the extractor URL patterns and build a YoutubeDL for extraction
+    # before the first request needs them (no-ops when serve.py preloaded them)
+    asyncio.get_running_loop().run_in_executor(None, warm_extractors)
+    asyncio.get_running_loop().run_in_executor(None, ydl_pool.warm, base_ydl_opts())
+    yield
+    sweeper.cancel()
+    job_workers.stop()
+    tracer.flush()
+    extract_executor.shutdown()
+    download_executor.shutdown()
+    multiprocess.mark_process_dead(os.getpid())
+
+app = FastAPI(title="YouTube Downloader API", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware - Allow all origins
 app.add_middleware(
@@ -23,17 +97,171 @@ app.add_middleware(
 )
 
 # Download directory
-DOWNLOAD_DIR = Path("/tmp/downloads")
-DOWNLOAD_DIR.mkdir(exist_ok=True)
+DOWNLOAD_DIR = Path(os.environ.get("DOWNLOAD_DIR", "/tmp/downloads"))
+DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+# Shared state database (lives on the downloads volume, shared by all workers)
+STATE_DB = DOWNLOAD_DIR / "state.sqlite3"
 
 # Cookies directory
-COOKIES_DIR = Path("/tmp/cookies")
-COOKIES_DIR.mkdir(exist_ok=True)
-COOKIES_FILE = COOKIES_DIR / "cookies.txt"
+COOKIES_DIR = Path(os.environ.get("COOKIES_DIR", "/tmp/cookies"))
+COOKIES_DIR.mkdir(parents=True, exist_ok=True)
+COOKIES_FILE = COOKIES_DIR / "cookies.txt"  # single jar of older versions, imported as "default"
+COOKIE_REFRESH_SECONDS = float(os.environ.get("COOKIE_REFRESH_SECONDS", "1"))  # how often workers look for new jars
+
+# Worker pools - yt-dlp is blocking, so it never runs on the event loop
+EXECUTOR_KIND = os.environ.get("EXECUTOR_KIND", "thread")  # "thread" or "process"
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", "8"))
+EXTRACT_QUEUE_SIZE = int(os.environ.get("EXTRACT_QUEUE_SIZE", "32"))
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", "2"))
+DOWNLOAD_QUEUE_SIZE = int(os.environ.get("DOWNLOAD_QUEUE_SIZE", "8"))
+QUEUE_TIMEOUT = float(os.environ.get("QUEUE_TIMEOUT", "30"))  # seconds to wait for a free slot
+RETRY_AFTER = int(os.environ.get("RETRY_AFTER", "30"))  # Retry-After hint on 503
+
+# Admission control - per-client token buckets, charged by format cost
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", "20"))  # bucket size in cost units, 0 disables
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE", "10"))  # cost units refilled per minute
+FORMAT_COSTS = {
+    "4k": 8,
+    "1440p": 6,
+    "1080p": 4,
+    "720p": 3,
+    "480p": 2,
+    "360p": 1,
+    "240p": 1,
+    "144p": 1,
+}
+FORMAT_COSTS.update(json.loads(os.environ.get("FORMAT_COSTS", "{}")))
+DEFAULT_COST = float(os.environ.get("DEFAULT_COST", "1"))  # audio and anything not listed above
+
+# Result cache - finished downloads keyed by (video id, format)
+CACHE_DIR = DOWNLOAD_DIR / "cache"
+CACHE_DIR.mkdir(exist_ok=True)
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", str(10 * 1024 ** 3)))  # 0 disables the cache
+LOCKS_DIR = DOWNLOAD_DIR / "locks"
+LOCKS_DIR.mkdir(exist_ok=True)
+
+# Served artifacts - results that are not cached stay downloadable for a grace window
+ARTIFACTS_DIR = DOWNLOAD_DIR / "artifacts"
+ARTIFACTS_DIR.mkdir(exist_ok=True)
+ARTIFACT_GRACE_SECONDS = int(os.environ.get("ARTIFACT_GRACE_SECONDS", "3600"))  # 0 deletes right after sending
+SWEEP_INTERVAL = int(os.environ.get("SWEEP_INTERVAL", "60"))  # seconds between storage sweeps
+
+# Storage quota - downloads reserve their estimated size before they start
+STORAGE_QUOTA_BYTES = int(os.environ.get("STORAGE_QUOTA_BYTES", str(20 * 1024 ** 3)))  # 0 disables the quota
+STORAGE_MIN_FREE_BYTES = int(os.environ.get("STORAGE_MIN_FREE_BYTES", str(1024 ** 3)))  # keep this much of the disk free
+STORAGE_DEFAULT_ESTIMATE = int(os.environ.get("STORAGE_DEFAULT_ESTIMATE", str(512 * 1024 ** 2)))  # when sizes are unknown
+STORAGE_WAIT_SECONDS = float(os.environ.get("STORAGE_WAIT_SECONDS", "30"))  # wait for space before 507
+STORAGE_STALE_SECONDS = int(os.environ.get("STORAGE_STALE_SECONDS", "3600"))  # untouched temp files are orphans
+
+# Derived formats - audio codecs and video muxes are built from cached source streams
+TRANSCODE_WORKERS = int(os.environ.get("TRANSCODE_WORKERS", str(os.cpu_count() or 1)))  # ffmpeg processes per host
+
+# Metadata cache - extraction results shared by all workers
+INFO_CACHE_TTL = int(os.environ.get("INFO_CACHE_TTL", "1800"))  # seconds (stream URLs expire after ~6h)
+INFO_CACHE_NEGATIVE_TTL = int(os.environ.get("INFO_CACHE_NEGATIVE_TTL", "60"))  # seconds to remember failures
+
+# Download tuning profiles - yt-dlp throughput options, chosen per format
+DOWNLOAD_PROFILES = {
+    "light": {
+        "concurrent_fragment_downloads": 1,
+        "buffersize": 16 * 1024,
+    },
+    "default": {
+        "concurrent_fragment_downloads": 4,
+        "http_chunk_size": 10 * 1024 * 1024,
+        "buffersize": 64 * 1024,
+    },
+    "aggressive": {
+        "concurrent_fragment_downloads": 16,
+        "http_chunk_size": 10 * 1024 * 1024,
+        "buffersize": 256 * 1024,
+        "external_downloader": "aria2c",  # used only when installed
+    },
+}
+DOWNLOAD_PROFILES.update(json.loads(os.environ.get("DOWNLOAD_PROFILES", "{}")))
+FORMAT_PROFILES = {
+    "4k": "aggressive",
+    "1440p": "aggressive",
+    "1080p": "default",
+    "720p": "default",
+    "480p": "default",
+    "360p": "light",
+    "240p": "light",
+    "144p": "light",
+}
+FORMAT_PROFILES.update(json.loads(os.environ.get("FORMAT_PROFILES", "{}")))
+DEFAULT_PROFILE = os.environ.get("DEFAULT_PROFILE", "light")  # audio and anything not listed above
+
+# Warm YoutubeDL instances kept per option profile
+YDL_POOL_SIZE = int(os.environ.get("YDL_POOL_SIZE", "4"))  # idle instances per profile, 0 disables reuse
+
+# Enabled extractors, as in yt-dlp's --use-extractors (e.g. "youtube.*"); the
+# URL patterns of the others are never compiled
+YDL_EXTRACTORS = os.environ.get("YDL_EXTRACTORS", "default").split(",")
+
+# Origin failures - transient errors are retried with jittered exponential
+# backoff, and a circuit breaker stops calling YouTube while it throttles us
+RETRY_ATTEMPTS = int(os.environ.get("RETRY_ATTEMPTS", "3"))  # tries per extraction or download, 1 disables retries
+RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", "1"))  # seconds, doubled per attempt
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", "20"))
+BREAKER_THRESHOLD = int(os.environ.get("BREAKER_THRESHOLD", "5"))  # throttling errors that open the breaker, 0 disables it
+BREAKER_WINDOW = float(os.environ.get("BREAKER_WINDOW", "60"))  # seconds in which they are counted
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", "30"))  # seconds open, doubled after a throttled probe
+BREAKER_MAX_COOLDOWN = float(os.environ.get("BREAKER_MAX_COOLDOWN", "600"))
+
+# Streaming downloads
+STREAM_CHUNK_SIZE = int(os.environ.get("STREAM_CHUNK_SIZE", str(256 * 1024)))
+STREAM_POLL_INTERVAL = float(os.environ.get("STREAM_POLL_INTERVAL", "0.1"))  # seconds between reads of a growing file
+
+# Background jobs
+JOBS_DIR = DOWNLOAD_DIR / "jobs"
+JOBS_DIR.mkdir(exist_ok=True)
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))  # per uvicorn worker
+JOB_QUEUE_LIMIT = int(os.environ.get("JOB_QUEUE_LIMIT", "100"))  # max queued jobs
+JOB_CLIENT_QUEUE_LIMIT = int(os.environ.get("JOB_CLIENT_QUEUE_LIMIT", str(JOB_QUEUE_LIMIT // 2)))  # max queued jobs of one client
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "120"))  # requeue if no heartbeat
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION_SECONDS = int(os.environ.get("JOB_RETENTION_SECONDS", "86400"))  # keep results for 24h
+PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", "0.5"))  # seconds between progress updates
+PROGRESS_KEEPALIVE = float(os.environ.get("PROGRESS_KEEPALIVE", "15"))  # SSE comment when nothing changed
+# Playlists are cut off here; a batch is queued at once, so it must fit in the
+# queue and in the client's share of it
+BATCH_MAX_ITEMS = min(int(os.environ.get("BATCH_MAX_ITEMS", str(JOB_CLIENT_QUEUE_LIMIT))), JOB_QUEUE_LIMIT, JOB_CLIENT_QUEUE_LIMIT)
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "4"))  # per-batch cap
+
+# Multiple nodes - a job queue shared by all nodes, and a store that results
+# are copied to so that any node can serve them
+JOB_BACKEND = os.environ.get("JOB_BACKEND", "sqlite")  # "sqlite" (this node) or "directory" (shared)
+JOB_STATE_DIR = Path(os.environ.get("JOB_STATE_DIR", str(DOWNLOAD_DIR / "queue")))  # shared directory (NFS) for "directory"
+JOB_CLAIM_BACKOFF = float(os.environ.get("JOB_CLAIM_BACKOFF", "0.1"))  # seconds per running cost unit before claiming
+ARTIFACT_STORE = os.environ.get("ARTIFACT_STORE", "")  # "file:///shared/dir" or "s3://bucket/prefix", empty for none
+ARTIFACT_STORE_TTL = int(os.environ.get("ARTIFACT_STORE_TTL", str(7 * 86400)))  # seconds, 0 keeps objects
+
+# Tracing - per-request spans exported as OpenTelemetry (OTLP/JSON) traces, and
+# a sampling profiler that keeps the stacks of slow requests
+TRACE_EXPORT = os.environ.get("TRACE_EXPORT", "")  # JSON lines file or http(s):// OTLP/HTTP endpoint, empty disables
+TRACE_MAX_SPANS = int(os.environ.get("TRACE_MAX_SPANS", "2000"))  # per trace, further spans are dropped
+PROFILE_THRESHOLD = float(os.environ.get("PROFILE_THRESHOLD", "0"))  # seconds; slower requests dump stacks, 0 disables
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.01"))  # seconds between stack samples
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", str(DOWNLOAD_DIR / "profiles")))
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", "100"))  # newest profiles kept
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or None  # for MinIO and other S3-compatible services
 
 class DownloadRequest(BaseModel):
     url: str
     format: str  # e.g., "144p", "240p", "360p", "480p", "720p", "1080p", "1440p", "4k", "mp3", "m4a", "webm", "aac", "flac", "opus", "ogg", "wav"
+    stream: bool = False  # send bytes while the download is still running
+    start: Optional[float] = None  # clip start in seconds
+    end: Optional[float] = None  # clip end in seconds
+    chapters: list[str] = []  # chapter title regexes, instead of start/end
+    precise_cuts: bool = False  # re-encode so the clip starts exactly at start, not at a keyframe
+
+class BatchRequest(BaseModel):
+    urls: list[str] = []
+    playlist_url: Optional[str] = None  # enumerated cheaply with extract_flat
+    format: str
+    concurrency: int = 2  # items of this batch downloading at the same time
 
 class VideoInfo(BaseModel):
     title: str
@@ -41,6 +269,583 @@ class VideoInfo(BaseModel):
     thumbnail: str
     formats: list
 
+# Metrics
+STAGE_SECONDS = Histogram(
+    "ytdl_stage_seconds", "Time spent in each stage of a request", ["stage", "format"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600),
+)
+DOWNLOADS = Counter("ytdl_downloads_total", "yt-dlp downloads by result", ["format", "result"])
+DOWNLOADED_BYTES = Counter("ytdl_downloaded_bytes_total", "Bytes downloaded from the origin", ["format"])
+SERVED_BYTES = Counter("ytdl_served_bytes_total", "Bytes sent to clients", ["format"])
+CACHE_LOOKUPS = Counter("ytdl_cache_lookups_total", "Cache lookups by cache and result", ["cache", "result"])
+POOL_RUNNING = Gauge("ytdl_pool_running", "Work running in a worker pool", ["pool"], multiprocess_mode="livesum")
+POOL_WAITING = Gauge("ytdl_pool_waiting", "Requests waiting for a worker pool slot", ["pool"], multiprocess_mode="livesum")
+POOL_REJECTED = Counter("ytdl_pool_rejected_total", "Requests rejected because a worker pool was full", ["pool"])
+STORAGE_REJECTED = Counter("ytdl_storage_rejected_total", "Downloads rejected because the storage quota was full")
+RATE_LIMITED = Counter("ytdl_rate_limited_total", "Requests rejected by the per-client rate limit", ["endpoint"])
+ARTIFACT_STORE_ERRORS = Counter("ytdl_artifact_store_errors_total", "Failed artifact store operations", ["operation"])
+ORIGIN_ERRORS = Counter("ytdl_origin_errors_total", "Failed extractions and downloads by error class", ["kind"])
+BREAKER_OPEN = Gauge("ytdl_breaker_open", "1 while the origin circuit breaker is open or half-open", multiprocess_mode="livemax")
+BREAKER_REJECTED = Counter("ytdl_breaker_rejected_total", "Origin calls rejected by the open circuit breaker")
+TRACES_DROPPED = Counter("ytdl_traces_dropped_total", "Traces that could not be exported")
+
+# W3C trace context of the caller: version-trace id-parent span id-flags
+TRACEPARENT = re.compile(r"00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}")
+
+def otlp_attributes(attributes: dict) -> list:
+    """Attributes in OTLP/JSON form, leaving out unset ones"""
+    result = []
+    for key, value in attributes.items():
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = {"boolValue": value}
+        elif isinstance(value, int):
+            value = {"intValue": str(value)}
+        elif isinstance(value, float):
+            value = {"doubleValue": value}
+        else:
+            value = {"stringValue": str(value)}
+        result.append({"key": key, "value": value})
+    return result
+
+class Trace:
+    """The spans of one request or job, and the stacks sampled while it ran"""
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or os.urandom(16).hex()
+        self.root = None
+        self.spans = []
+        self.dropped = 0
+        self.samples = collections.Counter()  # collapsed stack -> samples
+        self.lock = threading.Lock()
+
+    def add(self, span: "Span"):
+        with self.lock:
+            if len(self.spans) < TRACE_MAX_SPANS or span is self.root:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+class Span:
+    """A timed operation of a trace, with attributes and events as in OpenTelemetry"""
+
+    INTERNAL, SERVER = 1, 2  # OTLP span kinds
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[str] = None, kind: int = INTERNAL,
+                 attributes: Optional[dict] = None):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.events = []  # (time, name, attributes)
+        self.error = None
+        self.start = time.time_ns()
+        self.end = None
+
+    def child(self, name: str, **attributes) -> "Span":
+        return Span(self.trace, name, self.span_id, attributes=attributes)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def event(self, name: str, **attributes):
+        self.events.append((time.time_ns(), name, attributes))
+
+    def fail(self, error: BaseException):
+        """Mark the span as failed, recording the exception as OpenTelemetry does"""
+        self.error = f"{type(error).__name__}: {error}"[:1000]
+        self.event("exception", **{"exception.type": type(error).__name__, "exception.message": str(error)[:1000]})
+
+    def finish(self, error: Optional[BaseException] = None):
+        if self.end is not None:
+            return
+        if error is not None:
+            self.fail(error)
+        self.end = time.time_ns()
+        self.trace.add(self)
+        if self is self.trace.root:
+            tracer.close(self.trace)
+
+    def otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": otlp_attributes(self.attributes),
+            "events": [
+                {"timeUnixNano": str(at), "name": name, "attributes": otlp_attributes(attributes)}
+                for at, name, attributes in self.events
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+class NoSpan:
+    """Stands in for the current span outside traced work, so callers need no checks"""
+
+    trace = None
+
+    def __bool__(self):
+        return False
+
+    def child(self, name: str, **attributes) -> "NoSpan":
+        return self
+
+    def set(self, **attributes):
+        pass
+
+    def event(self, name: str, **attributes):
+        pass
+
+    def fail(self, error: BaseException):
+        pass
+
+    def finish(self, error: Optional[BaseException] = None):
+        pass
+
+NO_SPAN = NoSpan()
+current_span = contextvars.ContextVar("current_span", default=NO_SPAN)
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block as a child of the current span (a no-op outside traced work)"""
+    child = current_span.get().child(name, **attributes)
+    if not child:
+        yield child
+        return
+    token = current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.finish(e)
+        raise
+    finally:
+        current_span.reset(token)
+        child.finish()
+
+class SamplingProfiler:
+    """Samples the stacks of the threads that work on traced requests.
+
+    Pool threads and job workers are attached to the trace of the work they
+    run, and every PROFILE_INTERVAL the stack of each attached thread is
+    counted in its trace. The stacks of traces slower than PROFILE_THRESHOLD
+    are written to PROFILE_DIR in the folded format ("thread;frame;frame
+    samples" per line) that flamegraph.pl, inferno and speedscope read.
+    The event loop thread is shared by all requests and is not sampled, and
+    neither are the threads yt-dlp starts for concurrent fragments.
+    """
+
+    def __init__(self, threshold: float, interval: float, directory: Path, keep: int):
+        self.threshold = threshold
+        self.interval = interval
+        self.directory = directory
+        self.keep = keep
+        self.threads = {}  # thread id -> (trace, thread name)
+        self.names = {}  # code object -> frame name
+        self.active = threading.Event()
+        self.lock = threading.Lock()
+        self.pid = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def attach(self, trace: Trace):
+        """Sample the current thread into a trace until detach()"""
+        if not self.enabled:
+            return
+        with self.lock:
+            if self.pid != os.getpid():  # started lazily in each worker process
+                self.pid = os.getpid()
+                threading.Thread(target=self._run, name="profiler", daemon=True).start()
+        # Pool threads are merged into one root frame per pool
+        name = re.sub(r"[-_]\d+$", "", threading.current_thread().name)
+        self.threads[threading.get_ident()] = (trace, name)
+        self.active.set()
+
+    def detach(self):
+        self.threads.pop(threading.get_ident(), None)
+
+    def frame_name(self, code) -> str:
+        name = self.names.get(code)
+        if name is None:
+            name = self.names[code] = f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return name
+
+    def _run(self):
+        while True:
+            self.active.wait()
+            time.sleep(self.interval)
+            threads = list(self.threads.items())
+            if not threads:
+                self.active.clear()
+                if self.threads:  # attached meanwhile
+                    self.active.set()
+                continue
+            frames = sys._current_frames()
+            for ident, (trace, name) in threads:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(self.frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(name)
+                with trace.lock:
+                    trace.samples[";".join(reversed(stack))] += 1
+            del frames
+
+    def dump(self, trace: Trace) -> Optional[str]:
+        """Write the stacks of a trace to a folded file, returning its path"""
+        with trace.lock:
+            samples = sorted(trace.samples.items())
+        if not samples:
+            return None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{trace.trace_id}.folded"
+        path.write_text("".join(f"{stack} {count}\n" for stack, count in samples))
+        profiles = []
+        for profile in self.directory.glob("*.folded"):
+            try:
+                profiles.append((profile.stat().st_mtime, profile))
+            except FileNotFoundError:
+                pass  # removed by another worker
+        for _, profile in sorted(profiles)[:-self.keep or None]:
+            profile.unlink(missing_ok=True)
+        return str(path)
+
+profiler = SamplingProfiler(PROFILE_THRESHOLD, PROFILE_INTERVAL, PROFILE_DIR, PROFILE_KEEP)
+
+class Tracer:
+    """Builds a trace per request or job and exports the finished ones.
+
+    Traces are exported as OTLP/JSON, the format of OpenTelemetry's file
+    exporter and of OTLP/HTTP collectors: each trace is appended to the
+    TRACE_EXPORT file as a line, or POSTed to it when it is an http(s):// URL
+    (e.g. a collector's http://collector:4318/v1/traces). Exporting and
+    writing profiles happen in a background thread, so requests never wait
+    for them; traces that do not fit the queue are dropped and counted.
+    """
+
+    def __init__(self, export: str):
+        self.export = export
+        self.queue = None
+        self.lock = threading.Lock()
+        self.pid = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.export) or profiler.enabled
+
+    def start(self, name: str, traceparent: Optional[str] = None, kind: int = Span.INTERNAL, **attributes) -> Span:
+        """Root span of a new trace, joining the caller's trace if it sent a traceparent"""
+        match = TRACEPARENT.fullmatch(traceparent or "")
+        trace = Trace(match.group(1) if match else None)
+        trace.root = Span(trace, name, match.group(2) if match else None, kind, attributes)
+        return trace.root
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """Run background work in the current thread as a trace of its own"""
+        if not self.enabled:
+            yield NO_SPAN
+            return
+        root = self.start(name, **attributes)
+        token = current_span.set(root)
+        profiler.attach(root.trace)
+        try:
+            yield root
+        except BaseException as e:
+            root.fail(e)
+            raise
+        finally:
+            profiler.detach()
+            current_span.reset(token)
+            root.finish()
+
+    def close(self, trace: Trace):
+        """Queue a finished trace for export, with its stacks if it was slow"""
+        root = trace.root
+        slow = profiler.enabled and root.end - root.start > profiler.threshold * 1e9
+        if not (self.export or slow):
+            return
+        if trace.dropped:
+            root.set(dropped_spans=trace.dropped)
+        with self.lock:
+            if self.pid != os.getpid():  # started lazily in each worker process
+                self.pid = os.getpid()
+                self.queue = queue.Queue(maxsize=1000)
+                threading.Thread(target=self._run, name="trace-export", daemon=True).start()
+        try:
+            self.queue.put_nowait((trace, slow))
+        except queue.Full:
+            TRACES_DROPPED.inc()
+
+    def flush(self, timeout: float = 5):
+        """Wait a little for queued traces to be exported"""
+        deadline = time.monotonic() + timeout
+        while self.queue is not None and self.queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < 100:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for trace, slow in batch:
+                    if slow:
+                        trace.root.set(profile=profiler.dump(trace))
+                if self.export:
+                    self.send([trace for trace, _ in batch])
+            except Exception:
+                TRACES_DROPPED.inc(len(batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def send(self, traces: list):
+        if self.export.startswith(("http://", "https://")):
+            request = urllib.request.Request(
+                self.export, data=json.dumps(self.otlp(traces)).encode(),
+                headers={"Content-Type": "application/json"},
+            )
+            urllib.request.urlopen(request, timeout=10).close()
+            return
+        # One write per batch, so lines of several workers never interleave
+        lines = "".join(json.dumps(self.otlp([trace]), separators=(",", ":")) + "\n" for trace in traces)
+        fd = os.open(self.export, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, lines.encode())
+        finally:
+            os.close(fd)
+
+    def otlp(self, traces: list) -> dict:
+        """OTLP/JSON export request with the spans of some traces"""
+        spans = []
+        for trace in traces:
+            with trace.lock:
+                spans.extend(span.otlp() for span in trace.spans)
+        resource = {
+            "service.name": "youtube-downloader",
+            "service.version": app.version,
+            "host.name": socket.gethostname(),
+            "process.pid": os.getpid(),
+        }
+        return {"resourceSpans": [{
+            "resource": {"attributes": otlp_attributes(resource)},
+            "scopeSpans": [{"scope": {"name": "app"}, "spans": spans}],
+        }]}
+
+tracer = Tracer(TRACE_EXPORT)
+
+class TraceMiddleware:
+    """Trace each HTTP request, continuing the caller's W3C trace context"""
+
+    UNTRACED = ("/health", "/metrics")
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracer.enabled or scope["path"] in self.UNTRACED:
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        root = tracer.start(f"{scope['method']} {scope['path']}", headers.get("traceparent"), Span.SERVER, **{
+            "http.request.method": scope["method"],
+            "url.path": scope["path"],
+            "url.query": scope["query_string"].decode("latin-1") or None,
+            "user_agent.original": headers.get("user-agent"),
+        })
+        token = current_span.set(root)
+        status = None
+
+        async def traced_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-trace-id", root.trace.trace_id.encode())]
+            await send(message)
+
+        error = None
+        try:
+            await self.app(scope, receive, traced_send)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            current_span.reset(token)
+            # Named after the route once it is known, as OpenTelemetry does
+            route = getattr(scope.get("route"), "path", None)
+            if route:
+                root.name = f"{scope['method']} {route}"
+            root.set(**{"http.route": route, "http.response.status_code": status})
+            if error is None and status is not None and status >= 500:
+                root.error = f"HTTP {status}"
+            root.finish(error)
+
+app.add_middleware(TraceMiddleware)
+
+def run_traced(fn, *args):
+    """Run fn(*args) in a pool thread, sampled into the trace of the current span"""
+    trace = current_span.get().trace
+    if trace is None:
+        return fn(*args)
+    profiler.attach(trace)
+    try:
+        return fn(*args)
+    finally:
+        profiler.detach()
+
+class Overloaded(HTTPException):
+    """Work turned away before it started, so its rate limit charge is refunded.
+
+    503 when the server is full, 429 when the client is over its own share.
+    """
+
+    def __init__(self, detail: str, status_code: int = 503):
+        super().__init__(status_code=status_code, detail=detail, headers={"Retry-After": str(RETRY_AFTER)})
+
+class BoundedExecutor:
+    """Thread or process pool with separate caps on running and queued work.
+
+    Queued work is started in start-time fair queuing order: each client's
+    requests are spaced apart by their cost in virtual time, so a client
+    queueing many expensive downloads cannot starve the others.
+    """
+
+    def __init__(self, name: str, max_workers: int, max_queue: int, kind: str = EXECUTOR_KIND):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self.waiting = 0
+        self.running = 0
+        self._pool = None
+        self._free = max_workers
+        self._waiters = []  # heap of (virtual start, sequence, future)
+        self._finish = {}  # client -> virtual finish of its last request
+        self._vtime = 0.0
+        self._seq = itertools.count()
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            if self.kind == "process":
+                # Not forked from this process: its job, sweeper and warmup
+                # threads may hold locks that a forked child would inherit
+                # held. The fork server imports the app once for all children.
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload([__name__])
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+        return self._pool
+
+    def busy(self) -> Overloaded:
+        POOL_REJECTED.labels(self.name).inc()
+        return Overloaded(f"Server busy: too many {self.name} requests, try again later")
+
+    async def submit(self, fn, *args, client: str = "", cost: float = 1) -> asyncio.Future:
+        """Start fn(*args) in the pool once a slot is free, raising 503 when full"""
+        start = max(self._vtime, self._finish.get(client, 0.0))
+        if self._free and not self._waiters:
+            self._free -= 1
+            self._vtime = start
+        else:
+            if self.waiting >= self.max_queue:
+                raise self.busy()
+            granted = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (start, next(self._seq), granted))
+            self.waiting += 1
+            POOL_WAITING.labels(self.name).inc()
+            try:
+                with span(f"queue {self.name}", waiting=self.waiting):
+                    await asyncio.wait_for(asyncio.shield(granted), timeout=QUEUE_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+                if granted.done():
+                    self._grant_next()  # the slot was handed over just now
+                else:
+                    granted.cancel()
+                if isinstance(e, asyncio.TimeoutError):
+                    raise self.busy()
+                raise
+            finally:
+                self.waiting -= 1
+                POOL_WAITING.labels(self.name).dec()
+        self._finish[client] = start + cost
+
+        # The slot is released when the work really finishes, even if the
+        # client disconnects and the caller gets cancelled meanwhile
+        self.running += 1
+        POOL_RUNNING.labels(self.name).inc()
+        if self.kind == "process":
+            future = asyncio.get_running_loop().run_in_executor(self.pool, fn, *args)
+        else:
+            # Work in threads stays part of the request's trace
+            future = asyncio.get_running_loop().run_in_executor(
+                self.pool, contextvars.copy_context().run, run_traced, fn, *args,
+            )
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args, client: str = "", cost: float = 1):
+        """Run fn(*args) in the pool and wait for the result"""
+        return await asyncio.shield(await self.submit(fn, *args, client=client, cost=cost))
+
+    def _release(self, _future):
+        self.running -= 1
+        POOL_RUNNING.labels(self.name).dec()
+        self._grant_next()
+
+    def _grant_next(self):
+        """Hand a free slot to the waiter with the earliest virtual start"""
+        while self._waiters:
+            start, _, granted = heapq.heappop(self._waiters)
+            if not granted.done():
+                self._vtime = start
+                granted.set_result(None)
+                return
+        self._free += 1
+        # Clients that are caught up would start at the virtual time anyway
+        if len(self._finish) > 1024:
+            self._finish = {c: f for c, f in self._finish.items() if f > self._vtime}
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+extract_executor = BoundedExecutor("extract", EXTRACT_WORKERS, EXTRACT_QUEUE_SIZE)
+download_executor = BoundedExecutor("download", DOWNLOAD_WORKERS, DOWNLOAD_QUEUE_SIZE)
+
+@contextmanager
+def db_connect():
+    """Open an autocommit connection to the shared state database"""
+    conn = sqlite3.connect(STATE_DB, timeout=30, isolation_level=None)
+    try:
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        yield conn
+    finally:
+        conn.close()
+
+def safe_filename(title: str, ext: str) -> str:
+    """Build a download filename from the video title"""
+    safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).strip()
+    return f"{safe_title}{ext}"
+
 def get_format_selector(format_type: str) -> str:
     """Convert format type to yt-dlp format selector"""
     format_map = {
@@ -65,6 +870,21 @@ def get_format_selector(format_type: str) -> str:
     }
     return format_map.get(format_type.lower(), "best")
 
+def get_stream_selector(format_type: str) -> str:
+    """yt-dlp selector for a single-file format that can be streamed while downloading"""
+    stream_map = {
+        # Video formats (progressive files, no merge step)
+        "144p": "best[height<=144][vcodec!=none][acodec!=none]",
+        "240p": "best[height<=240][vcodec!=none][acodec!=none]",
+        "360p": "best[height<=360][vcodec!=none][acodec!=none]",
+        "480p": "best[height<=480][vcodec!=none][acodec!=none]",
+        "720p": "best[height<=720][vcodec!=none][acodec!=none]",
+        "1080p": "best[height<=1080][vcodec!=none][acodec!=none]",
+        "1440p": "best[height<=1440][vcodec!=none][acodec!=none]",
+        "4k": "best[height<=2160][vcodec!=none][acodec!=none]",
+    }
+    return stream_map.get(format_type.lower(), get_format_selector(format_type))
+
 def get_audio_format(format_type: str) -> Optional[str]:
     """Get the audio format for post-processing"""
     audio_formats = {
@@ -78,6 +898,666 @@ def get_audio_format(format_type: str) -> Optional[str]:
     }
     return audio_formats.get(format_type.lower())
 
+def normalize_format(format_type: str) -> str:
+    """Canonical format key, matching the fallback in get_format_selector"""
+    format_type = format_type.lower()
+    return format_type if get_format_selector(format_type) != "best" else "best"
+
+# The first YoutubeDL loads extractor plugins (yt_dlp_plugins packages on
+# sys.path); load them up front so that video_key() knows them too
+yt_dlp.plugins.load_all_plugins()
+
+@functools.cache
+def extractor_classes() -> list:
+    """Extractors enabled by YDL_EXTRACTORS, in the order YoutubeDL tries them"""
+    all_ies = {ie.IE_NAME.lower(): ie for ie in yt_dlp.extractor.gen_extractor_classes()}
+    names = yt_dlp.utils.orderedSet_from_options(YDL_EXTRACTORS, {
+        'all': list(all_ies),
+        'default': [name for name, ie in all_ies.items() if ie._ENABLED],
+    }, use_regex=True)
+    return [all_ies[name] for name in names if name in all_ies]
+
+def warm_extractors():
+    """Compile the URL patterns of the enabled extractors and import the YouTube extractor"""
+    video_key("https://example.com/")
+    if any(ie.ie_key() == "Youtube" for ie in extractor_classes()):
+        importlib.import_module("yt_dlp.extractor.youtube")
+
+@functools.lru_cache(maxsize=4096)
+def video_key(url: str) -> Optional[str]:
+    """Canonical id for the video behind a URL (extractor + video id), if known"""
+    for ie in extractor_classes():
+        if ie.suitable(url):
+            video_id = ie.get_temp_id(url)
+            if not video_id:
+                return None
+            key = f"{ie.ie_key()}_{video_id}"
+            return key if re.fullmatch(r'[\w-]+', key) else hashlib.sha1(key.encode()).hexdigest()
+    return None
+
+class ResultCache:
+    """Finished downloads on disk, keyed by video and format, evicted LRU.
+
+    Each entry is an artifact ``{video}.{format}{ext}`` plus a ``.json``
+    sidecar holding its title. Both are moved in with an atomic rename, the
+    sidecar last, so a partial file is never visible. Access time marks
+    recent use and the modification time is left alone.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def lookup(self, key: str, format_key: str) -> Optional[tuple]:
+        """Return (path, title) of a cached result, or None"""
+        if not self.enabled:
+            return None
+        try:
+            meta = json.loads((self.root / f"{key}.{format_key}.json").read_text())
+            path = self.root / f"{key}.{format_key}{meta['ext']}"
+            stat = path.stat()
+            os.utime(path, (time.time(), stat.st_mtime))
+        except (OSError, ValueError, KeyError):
+            return None
+        return path, meta['title']
+
+    def store(self, key: str, format_key: str, src: Path, title: str) -> Path:
+        """Move a finished download into the cache and return its new path"""
+        path = self.root / f"{key}.{format_key}{src.suffix}"
+        sidecar_tmp = self.root / f".{uuid.uuid4().hex}.json"
+        sidecar_tmp.write_text(json.dumps({"title": title, "ext": src.suffix}))
+        os.replace(src, path)
+        os.replace(sidecar_tmp, path.with_suffix(".json"))
+        self.evict()
+        return path
+
+    def evict(self, max_bytes: Optional[int] = None):
+        """Delete least recently used entries until the cache fits its budget"""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = []
+        total = 0
+        for entry in os.scandir(self.root):
+            if entry.name.startswith(".") or entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, Path(entry.path)))
+            total += stat.st_size
+
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            cleanup_file(path.with_suffix(".json"))
+            cleanup_file(path)
+            total -= size
+
+result_cache = ResultCache(CACHE_DIR, CACHE_MAX_BYTES)
+
+class DirectoryArtifactStore:
+    """Results shared by all nodes in a directory, e.g. an NFS mount.
+
+    Laid out like the result cache: ``{name}{ext}`` plus a ``{name}.json``
+    sidecar with the title and extension, both moved in with an atomic rename.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def put(self, src: Path, name: str, title: str):
+        tmp = self.root / f".{uuid.uuid4().hex}{src.suffix}"
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, self.root / f"{name}{src.suffix}")
+        sidecar_tmp = self.root / f".{uuid.uuid4().hex}.json"
+        sidecar_tmp.write_text(json.dumps({"title": title, "ext": src.suffix}))
+        os.replace(sidecar_tmp, self.root / f"{name}.json")
+
+    def stat(self, name: str) -> Optional[dict]:
+        """Title, extension and size of a stored result, or None"""
+        try:
+            meta = json.loads((self.root / f"{name}.json").read_text())
+            meta["size"] = (self.root / f"{name}{meta['ext']}").stat().st_size
+        except (OSError, ValueError, KeyError):
+            return None
+        return meta
+
+    def download(self, name: str, ext: str, dest: Path):
+        shutil.copyfile(self.root / f"{name}{ext}", dest)
+
+    def delete(self, name: str):
+        meta = self.stat(name)
+        cleanup_file(self.root / f"{name}.json")
+        if meta:
+            cleanup_file(self.root / f"{name}{meta['ext']}")
+
+    def sweep(self, max_age: int):
+        """Delete results stored more than max_age seconds ago"""
+        deadline = time.time() - max_age
+        for entry in os.scandir(self.root):
+            try:
+                if entry.stat().st_mtime < deadline:
+                    cleanup_file(Path(entry.path))
+            except OSError:
+                continue
+
+class S3ArtifactStore:
+    """Results shared by all nodes in an S3-compatible bucket (AWS S3, MinIO, ...).
+
+    Each result is one object ``{prefix}{name}`` with its title and extension
+    in the object metadata. Credentials come from the usual AWS environment
+    variables or config files. boto3 is only needed when this store is used.
+    """
+
+    def __init__(self, bucket: str, prefix: str, endpoint_url: Optional[str] = None):
+        import boto3
+        from botocore.config import Config
+        
+        self.bucket = bucket
+        self.prefix = prefix
+        # S3-compatible services usually expect path-style URLs
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, config=Config(
+            s3={"addressing_style": "path"} if endpoint_url else {},
+            retries={"max_attempts": 3, "mode": "standard"},
+        ))
+
+    def put(self, src: Path, name: str, title: str):
+        self.client.upload_file(str(src), self.bucket, self.prefix + name, ExtraArgs={
+            "Metadata": {"title": quote(title), "ext": src.suffix},
+        })
+
+    def stat(self, name: str) -> Optional[dict]:
+        """Title, extension and size of a stored result, or None"""
+        from botocore.exceptions import ClientError
+        
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.prefix + name)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        meta = head.get("Metadata", {})
+        return {"title": unquote(meta.get("title", "video")), "ext": meta.get("ext", ""), "size": head["ContentLength"]}
+
+    def download(self, name: str, ext: str, dest: Path):
+        self.client.download_file(self.bucket, self.prefix + name, str(dest))
+
+    def delete(self, name: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + name)
+
+    def sweep(self, max_age: int):
+        """Delete results stored more than max_age seconds ago (a bucket lifecycle rule does the same)"""
+        deadline = time.time() - max_age
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix):
+            expired = [{"Key": obj["Key"]} for obj in page.get("Contents", []) if obj["LastModified"].timestamp() < deadline]
+            if expired:
+                self.client.delete_objects(Bucket=self.bucket, Delete={"Objects": expired, "Quiet": True})
+
+def open_artifact_store(url: str):
+    """Artifact store for an ARTIFACT_STORE URL, or None to keep results on this node only"""
+    if not url:
+        return None
+    parsed = urlparse(url)
+    if parsed.scheme == "file":
+        return DirectoryArtifactStore(Path(parsed.path))
+    if parsed.scheme == "s3":
+        prefix = parsed.path.strip("/")
+        return S3ArtifactStore(parsed.netloc, f"{prefix}/" if prefix else "", S3_ENDPOINT_URL)
+    raise ValueError(f"Unsupported ARTIFACT_STORE: {url}")
+
+artifact_store = open_artifact_store(ARTIFACT_STORE)
+
+def publish_result(path: Path, title: str):
+    """Copy a result to the artifact store so that every node can serve it"""
+    if artifact_store is None:
+        return
+    try:
+        with span("artifact store put", name=path.stem, bytes=path.stat().st_size):
+            artifact_store.put(path, path.stem, title)
+    except Exception:
+        # The result is still served from this node
+        ARTIFACT_STORE_ERRORS.labels("put").inc()
+
+def restore_result(name: str) -> Optional[tuple]:
+    """Copy a result that another node stored to this node, returning (path, title) or None.
+
+    Cache entries (``{video}.{format}``) go back into the result cache and
+    anything else is kept for the grace window like a local artifact.
+    """
+    if artifact_store is None:
+        return None
+    try:
+        meta = artifact_store.stat(name)
+        CACHE_LOOKUPS.labels("store", "hit" if meta else "miss").inc()
+        if meta is None:
+            return None
+        tmp = DOWNLOAD_DIR / f"{uuid.uuid4()}{meta['ext']}"
+        with storage.reserve(meta['size']), span("artifact store get", name=name, bytes=meta['size']):
+            try:
+                artifact_store.download(name, meta['ext'], tmp)
+            except Exception:
+                cleanup_file(tmp)
+                raise
+    except HTTPException:
+        raise
+    except Exception:
+        ARTIFACT_STORE_ERRORS.labels("get").inc()
+        return None
+    key, _, format_key = name.partition(".")
+    if format_key and result_cache.enabled:
+        return result_cache.store(key, format_key, tmp, meta['title']), meta['title']
+    return keep_artifact(tmp, meta['title'], name), meta['title']
+
+def keep_artifact(src: Path, title: str, name: Optional[str] = None) -> Path:
+    """Keep a result that is not cached downloadable for the grace window"""
+    path = ARTIFACTS_DIR / (f"{name}{src.suffix}" if name else src.name)
+    path.with_suffix(".json").write_text(json.dumps({"title": title, "ext": src.suffix}))
+    os.replace(src, path)
+    return path
+
+def find_artifact(name: str) -> Optional[tuple]:
+    """Return (path, title) of a cached or kept result by file name, or None"""
+    if name.startswith(".") or name.endswith(".json") or Path(name).name != name:
+        return None
+    for root in (CACHE_DIR, ARTIFACTS_DIR):
+        path = root / name
+        try:
+            meta = json.loads(path.with_suffix(".json").read_text())
+            if path.exists():
+                return path, meta['title']
+        except (OSError, ValueError, KeyError):
+            continue
+    # Results of other nodes
+    restored = restore_result(Path(name).stem)
+    if restored and restored[0].name == name:
+        return restored
+    return None
+
+def local_result(file_path: Path) -> Optional[Path]:
+    """A job result on this node, copied from the artifact store if another node made it"""
+    if file_path.exists():
+        return file_path
+    artifact = find_artifact(file_path.name)
+    return artifact[0] if artifact else None
+
+def sweep_artifacts():
+    """Delete kept results whose grace window has passed"""
+    deadline = time.time() - ARTIFACT_GRACE_SECONDS
+    for entry in os.scandir(ARTIFACTS_DIR):
+        try:
+            if entry.stat().st_mtime < deadline:
+                cleanup_file(Path(entry.path))
+        except OSError:
+            continue
+
+def directory_size(path: Path) -> int:
+    """Total size of the files directly inside a directory"""
+    total = 0
+    for entry in os.scandir(path):
+        try:
+            if entry.is_file(follow_symlinks=False):
+                total += entry.stat().st_size
+        except OSError:
+            continue
+    return total
+
+# Bytes per second of the uncompressed or high-bitrate audio outputs
+AUDIO_BYTES_PER_SECOND = {"mp3": 40_000, "flac": 100_000, "wav": 176_400}
+
+# yt-dlp temporary files: partial downloads, resume state, unmerged streams
+PARTIAL_FILE = re.compile(r'.*\.(part|ytdl|temp)$|.*\.part-Frag\d+|.*\.f[\w-]+\.\w+$')
+
+def estimate_size(info: dict, format_key: str) -> int:
+    """Disk space a download may need, from the sizes of the planned formats"""
+    planned = FormatTable.from_info(info).plan(format_key) if info.get('formats') else None
+    estimate = planned[1] if planned else 0
+    if estimate and format_key in AUDIO_BYTES_PER_SECOND:
+        estimate += (info.get('duration') or 0) * AUDIO_BYTES_PER_SECOND[format_key]
+    # Streams and the merged or converted result exist side by side at the end
+    return 2 * estimate if estimate else STORAGE_DEFAULT_ESTIMATE
+
+class StorageManager:
+    """Disk quota for DOWNLOAD_DIR, shared by all workers through the state database.
+
+    Each download reserves its estimated size first. A reservation is granted
+    while the bytes on disk plus all open reservations fit the quota and the
+    free space on the volume. Otherwise cached results are evicted if that makes
+    it fit; if it cannot, the shortfall comes from other downloads, and the
+    download waits for them to release space and finally gets a 507.
+    Bytes on disk are rescanned at most once per second per worker.
+    """
+
+    def __init__(self, root: Path, quota: int, min_free: int):
+        self.root = root
+        self.quota = quota
+        self.min_free = min_free
+        self._used = (0.0, 0)  # (scanned at, bytes)
+        with db_connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reservations (
+                    id TEXT PRIMARY KEY,
+                    bytes INTEGER NOT NULL,
+                    pid INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+
+    def used(self) -> int:
+        """Bytes in DOWNLOAD_DIR and its areas"""
+        scanned_at, used = self._used
+        if time.monotonic() - scanned_at > 1:
+            used = sum(directory_size(path) for path in (self.root, CACHE_DIR, ARTIFACTS_DIR, JOBS_DIR))
+            self._used = (time.monotonic(), used)
+        return used
+
+    def reserved(self) -> int:
+        with db_connect() as conn:
+            (reserved,) = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM reservations").fetchone()
+        return reserved
+
+    def shortfall(self, size: int, reserved: int) -> int:
+        """Bytes that would have to be freed before size more fit"""
+        over_quota = self.used() + reserved + size - self.quota if self.quota else 0
+        under_free = self.min_free + reserved + size - shutil.disk_usage(self.root).free
+        return max(over_quota, under_free, 0)
+
+    def _try_reserve(self, size: int) -> Optional[str]:
+        with db_connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            (reserved,) = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM reservations").fetchone()
+            missing = self.shortfall(size, reserved)
+            if missing:
+                conn.execute("ROLLBACK")
+                # Cached results are the cheapest bytes to give back, but
+                # emptying the cache cannot help while more than it holds is
+                # missing; retries would only throw it away bit by bit
+                cached = directory_size(CACHE_DIR) if result_cache.enabled else 0
+                if missing <= cached:
+                    result_cache.evict(cached - missing)
+                    self._used = (0.0, 0)
+                return None
+            reservation_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO reservations (id, bytes, pid, created_at) VALUES (?, ?, ?, ?)",
+                (reservation_id, size, os.getpid(), time.time()),
+            )
+            conn.execute("COMMIT")
+        return reservation_id
+
+    @contextmanager
+    def reserve(self, size: int):
+        """Hold space for a download, waiting up to STORAGE_WAIT_SECONDS for it"""
+        deadline = time.monotonic() + STORAGE_WAIT_SECONDS
+        with span("reserve storage", bytes=size):
+            while (reservation_id := self._try_reserve(size)) is None:
+                if (self.quota and size > self.quota) or time.monotonic() > deadline:
+                    STORAGE_REJECTED.inc()
+                    raise HTTPException(
+                        status_code=507,
+                        detail="Not enough storage for this download, try again later",
+                        headers={"Retry-After": str(RETRY_AFTER)},
+                    )
+                time.sleep(1)
+        try:
+            yield
+        finally:
+            with db_connect() as conn:
+                conn.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,))
+
+    def release_dead(self):
+        """Drop reservations of worker processes that are gone"""
+        with db_connect() as conn:
+            for row in conn.execute("SELECT id, pid FROM reservations").fetchall():
+                try:
+                    os.kill(row["pid"], 0)
+                except ProcessLookupError:
+                    conn.execute("DELETE FROM reservations WHERE id = ?", (row["id"],))
+                except PermissionError:
+                    pass
+
+storage = StorageManager(DOWNLOAD_DIR, STORAGE_QUOTA_BYTES, STORAGE_MIN_FREE_BYTES)
+
+def sweep_orphans():
+    """Delete temporary files left behind by crashed or killed downloads"""
+    deadline = time.time() - STORAGE_STALE_SECONDS
+    
+    def stale(entry) -> bool:
+        try:
+            # yt-dlp sets mtime from Last-Modified, ctime is the last real change
+            return entry.is_file(follow_symlinks=False) and entry.stat().st_ctime < deadline
+        except OSError:
+            return False
+    
+    # Downloads, streams and conversions outside the jobs are named by uuid
+    for entry in os.scandir(DOWNLOAD_DIR):
+        if re.match(r'[0-9a-f]{8}-[0-9a-f]{4}-', entry.name) and stale(entry):
+            cleanup_file(Path(entry.path))
+    
+    # Job results belong to their job until it expires
+    jobs = job_queue.ids()
+    for entry in os.scandir(JOBS_DIR):
+        if (PARTIAL_FILE.match(entry.name) or entry.name.split(".")[0] not in jobs) and stale(entry):
+            cleanup_file(Path(entry.path))
+    
+    # Sidecars that were never moved in, and artifacts that lost their sidecar
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.endswith(".json") and not entry.name.startswith("."):
+            continue
+        if (entry.name.startswith(".") or not Path(entry.path).with_suffix(".json").exists()) and stale(entry):
+            cleanup_file(Path(entry.path))
+    
+    storage.release_dead()
+
+async def storage_sweeper():
+    """Periodically clean up the downloads volume"""
+    store_swept = time.monotonic()
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL)
+        try:
+            await asyncio.to_thread(sweep_artifacts)
+            await asyncio.to_thread(sweep_orphans)
+            await asyncio.to_thread(rate_limiter.prune)
+            # Listing the whole store is slow, so it is swept hourly
+            if artifact_store is not None and ARTIFACT_STORE_TTL > 0 and time.monotonic() - store_swept > 3600:
+                store_swept = time.monotonic()
+                await asyncio.to_thread(artifact_store.sweep, ARTIFACT_STORE_TTL)
+        except Exception:
+            pass
+
+class ArtifactResponse(FileResponse):
+    """FileResponse with a stable ETag and If-None-Match support.
+
+    Range and If-Range requests (206, multipart/byteranges) are handled by
+    FileResponse. Bodies are read and sent in chunk_size chunks; uvicorn, which
+    serve.py runs, has no zero-copy path. Whole-file responses use the ASGI
+    pathsend extension instead on servers that offer it, which then send the
+    file themselves.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, path: Path, filename: str, content_location: Optional[str] = None,
+                 format_key: str = "file"):
+        self.format_key = format_key
+        stat = path.stat()
+        etag = hashlib.sha1(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+        headers = {"etag": f'"{etag}"', "cache-control": "private, max-age=0, must-revalidate"}
+        if content_location:
+            headers["content-location"] = content_location
+        super().__init__(
+            path=path,
+            filename=filename,
+            media_type='application/octet-stream',
+            headers=headers,
+            stat_result=stat,
+        )
+
+    async def __call__(self, scope, receive, send):
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        if if_none_match:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            if "*" in tags or self.headers["etag"] in tags:
+                not_modified = {
+                    name: self.headers[name]
+                    for name in ("etag", "cache-control", "content-location", "last-modified")
+                    if name in self.headers
+                }
+                await Response(status_code=304, headers=not_modified)(scope, receive, send)
+                return
+        
+        sent = 0
+        
+        async def counting_send(message):
+            nonlocal sent
+            if message['type'] == 'http.response.body':
+                sent += len(message.get('body', b''))
+            elif message['type'] == 'http.response.pathsend':
+                sent += self.stat_result.st_size
+            await send(message)
+        
+        started = time.monotonic()
+        with span("send", format=self.format_key) as send_span:
+            try:
+                await super().__call__(scope, receive, counting_send)
+            finally:
+                STAGE_SECONDS.labels("send", self.format_key).observe(time.monotonic() - started)
+                SERVED_BYTES.labels(self.format_key).inc(sent)
+                send_span.set(bytes=sent)
+
+@contextmanager
+def file_lock(name: str):
+    """Exclusive lock shared by all worker processes, released if the holder dies"""
+    with open(LOCKS_DIR / f"{name}.lock", "w") as lock_file:
+        with span("lock", lock=name):
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into a single call"""
+
+    def __init__(self):
+        self.calls = {}
+
+    async def run(self, key, fn, *args):
+        future = self.calls.get(key)
+        if future is not None:
+            current_span.get().set(coalesced=True)  # the spans are in the first caller's trace
+        else:
+            future = asyncio.ensure_future(fn(*args))
+            self.calls[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        return await asyncio.shield(future)
+
+    def _done(self, key, future):
+        self.calls.pop(key, None)
+        if not future.cancelled():
+            future.exception()  # mark as retrieved even if every waiter went away
+
+download_flights = SingleFlight()
+
+def format_cost(format_type: str) -> float:
+    """Admission cost of one download in a format"""
+    return FORMAT_COSTS.get(normalize_format(format_type), DEFAULT_COST)
+
+def client_id(request: Request) -> str:
+    """Client address (uvicorn resolves X-Forwarded-For with --proxy-headers)"""
+    return request.client.host if request.client else "unknown"
+
+class RateLimiter:
+    """Token bucket per client, shared by all workers through the state database"""
+
+    def __init__(self, burst: float, per_minute: float):
+        self.burst = burst
+        self.rate = per_minute / 60
+        with db_connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    client TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+
+    @property
+    def enabled(self) -> bool:
+        return self.burst > 0 and self.rate > 0
+
+    def take(self, client: str, cost: float) -> float:
+        """Take cost tokens, returning 0 on success or the seconds until they are available.
+
+        A cost above the bucket size is admitted with a full bucket and leaves
+        the client in debt, which later requests wait out.
+        """
+        needed = min(cost, self.burst)  # anything is allowed eventually
+        now = time.time()
+        with db_connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tokens, updated_at FROM rate_limits WHERE client = ?", (client,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row["tokens"] + (now - row["updated_at"]) * self.rate)
+            if tokens < needed:
+                conn.execute("ROLLBACK")
+                return (needed - tokens) / self.rate
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (client, tokens, updated_at) VALUES (?, ?, ?)",
+                (client, tokens - cost, now),
+            )
+            conn.execute("COMMIT")
+        return 0.0
+
+    def credit(self, client: str, amount: float):
+        """Add tokens, up to a full bucket: given back for a request that was turned
+        away, or negative to charge for work found after admission"""
+        now = time.time()
+        with db_connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tokens, updated_at FROM rate_limits WHERE client = ?", (client,)).fetchone()
+            tokens = self.burst if row is None else row["tokens"] + (now - row["updated_at"]) * self.rate
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_limits (client, tokens, updated_at) VALUES (?, ?, ?)",
+                (client, min(self.burst, tokens + amount), now),
+            )
+            conn.execute("COMMIT")
+
+    def prune(self):
+        """Forget clients whose bucket has refilled completely"""
+        if self.enabled:
+            with db_connect() as conn:
+                conn.execute(
+                    "DELETE FROM rate_limits WHERE tokens + (? - updated_at) * ? >= ?",
+                    (time.time(), self.rate, self.burst),
+                )
+
+rate_limiter = RateLimiter(RATE_LIMIT_BURST, RATE_LIMIT_PER_MINUTE)
+
+async def admit(request: Request, endpoint: str, cost: float) -> str:
+    """Charge a client for a request before any work starts, raising 429 over its limit"""
+    client = client_id(request)
+    if rate_limiter.enabled:
+        retry_after = await asyncio.to_thread(rate_limiter.take, client, cost)
+        if retry_after:
+            RATE_LIMITED.labels(endpoint).inc()
+            raise HTTPException(
+                status_code=429,
+                detail="Rate limit exceeded, try again later",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+    return client
+
+async def refund(client: str, cost: float):
+    """Give back what admit charged for a request that was rejected as Overloaded"""
+    if rate_limiter.enabled:
+        await asyncio.to_thread(rate_limiter.credit, client, cost)
+
 @app.get("/", response_class=HTMLResponse)
 async def home():
     """Simple web interface"""
@@ -135,6 +1615,11 @@ async def home():
                 border-radius: 5px;
                 display: none;
             }
+            #progressBar {
+                width: 100%;
+                margin-top: 10px;
+                display: none;
+            }
             .success {
                 background: #d4edda;
                 color: #155724;
@@ -275,6 +1760,7 @@ async def home():
             
             <button onclick="downloadVideo()">Download</button>
             <div id="status"></div>
+            <progress id="progressBar" max="100" value="0"></progress>
         </div>
 
         <script>
@@ -343,7 +1829,8 @@ async def home():
                         status.textContent = '✅ Cookies uploaded successfully! Bot detection should be fixed.';
                         checkCookieStatus();
                     } else {
-                        throw new Error('Upload failed');
+                        const error = await response.json().catch(() => ({}));
+                        throw new Error(error.detail || 'Upload failed');
                     }
                 } catch (error) {
                     status.className = 'error';
@@ -376,6 +1863,26 @@ async def home():
                 }
             }
 
+            function formatBytes(bytes) {
+                if (!bytes) return '0 B';
+                const units = ['B', 'KiB', 'MiB', 'GiB'];
+                const i = Math.min(Math.floor(Math.log(bytes) / Math.log(1024)), units.length - 1);
+                return (bytes / Math.pow(1024, i)).toFixed(i ? 1 : 0) + ' ' + units[i];
+            }
+
+            function describeProgress(job) {
+                if (job.state === 'queued') return '⏳ Queued, waiting for a free worker...';
+                if (job.stage && job.stage.startsWith('postprocessing')) return '⚙️ Converting (' + job.stage + ')...';
+                const parts = ['⬇️ Downloading ' + job.progress.toFixed(1) + '%'];
+                if (job.downloaded_bytes) {
+                    parts.push(formatBytes(job.downloaded_bytes) + (job.total_bytes ? ' of ' + formatBytes(job.total_bytes) : ''));
+                }
+                if (job.speed) parts.push(formatBytes(job.speed) + '/s');
+                if (job.eta != null) parts.push('ETA ' + job.eta + 's');
+                if (job.fragment_count) parts.push('fragment ' + job.fragment_index + '/' + job.fragment_count);
+                return parts.join(' · ');
+            }
+
             async function downloadVideo() {
                 const url = document.getElementById('url').value;
                 const audioOnly = document.getElementById('audioOnly').checked;
@@ -383,6 +1890,7 @@ async def home():
                     document.getElementById('audioFormat').value : 
                     document.getElementById('format').value;
                 const status = document.getElementById('status');
+                const progressBar = document.getElementById('progressBar');
 
                 if (!url) {
                     status.className = 'error';
@@ -393,10 +1901,23 @@ async def home():
 
                 status.className = 'loading';
                 status.style.display = 'block';
-                status.textContent = '⏳ Downloading... Please wait...';
+                status.textContent = '⏳ Starting download...';
+                progressBar.value = 0;
+                progressBar.style.display = 'block';
+
+                function fail(message) {
+                    progressBar.style.display = 'none';
+                    status.className = 'error';
+                    if (message.includes('bot')) {
+                        status.textContent = '❌ Bot detected! Please upload YouTube cookies (see instructions above ⬆️)';
+                    } else {
+                        status.textContent = '❌ Error: ' + message;
+                    }
+                }
 
                 try {
-                    const response = await fetch('/download', {
+                    // Queue a job and follow its progress, then fetch the finished file
+                    const response = await fetch('/jobs', {
                         method: 'POST',
                         headers: {
                             'Content-Type': 'application/json',
@@ -406,35 +1927,38 @@ async def home():
 
                     if (!response.ok) {
                         const error = await response.json();
-                        throw new Error(error.detail || 'Download failed');
+                        const retryAfter = response.headers.get('retry-after');
+                        throw new Error((error.detail || 'Download failed') + (retryAfter ? ' (retry in ' + retryAfter + 's)' : ''));
                     }
+                    const job = await response.json();
 
-                    // Get filename from header
-                    const contentDisposition = response.headers.get('content-disposition');
-                    const filename = contentDisposition 
-                        ? contentDisposition.split('filename=')[1].replace(/"/g, '')
-                        : 'download';
-
-                    // Download file
-                    const blob = await response.blob();
-                    const downloadUrl = window.URL.createObjectURL(blob);
-                    const a = document.createElement('a');
-                    a.href = downloadUrl;
-                    a.download = filename;
-                    document.body.appendChild(a);
-                    a.click();
-                    window.URL.revokeObjectURL(downloadUrl);
-                    document.body.removeChild(a);
-
-                    status.className = 'success';
-                    status.textContent = '✅ Download complete!';
+                    const events = new EventSource(job.events_url);
+                    events.addEventListener('progress', function(event) {
+                        const update = JSON.parse(event.data);
+                        status.textContent = describeProgress(update);
+                        progressBar.value = update.progress;
+                    });
+                    events.addEventListener('done', function(event) {
+                        events.close();
+                        const update = JSON.parse(event.data);
+                        if (update.state !== 'finished') {
+                            fail(update.error || 'Download failed');
+                            return;
+                        }
+                        progressBar.value = 100;
+                        status.className = 'success';
+                        status.textContent = '✅ Download complete!';
+                        window.location.href = update.file_url;
+                    });
+                    events.addEventListener('error', function(event) {
+                        // EventSource reconnects by itself; give up only on server errors
+                        if (event.data) {
+                            events.close();
+                            fail(JSON.parse(event.data).detail);
+                        }
+                    });
                 } catch (error) {
-                    status.className = 'error';
-                    if (error.message.includes('bot')) {
-                        status.textContent = '❌ Bot detected! Please upload YouTube cookies (see instructions above ⬆️)';
-                    } else {
-                        status.textContent = '❌ Error: ' + error.message;
-                    }
+                    fail(error.message);
                 }
             }
         </script>
@@ -443,106 +1967,1451 @@ async def home():
     """
     return HTMLResponse(content=html_content)
 
-@app.post("/download")
-async def download_video(request: DownloadRequest, background_tasks: BackgroundTasks):
-    """Download video/audio in specified format"""
-    try:
-        # Generate unique filename
-        file_id = str(uuid.uuid4())
-        
-        # Determine if audio format
-        audio_format = get_audio_format(request.format)
-        
-        # Configure yt-dlp options
-        ydl_opts = {
-            'format': get_format_selector(request.format),
-            'outtmpl': str(DOWNLOAD_DIR / f'{file_id}.%(ext)s'),
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
-            # Anti-bot detection measures
-            'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-            'referer': 'https://www.youtube.com/',
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-us,en;q=0.5',
-                'Sec-Fetch-Mode': 'navigate',
-            },
-        }
-        
-        # Add cookies if available
-        if COOKIES_FILE.exists():
-            ydl_opts['cookiefile'] = str(COOKIES_FILE)
-        
-        # Add audio conversion if needed
-        if audio_format:
-            ydl_opts['postprocessors'] = [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': audio_format,
-                'preferredquality': '320' if audio_format == 'mp3' else '0',
-            }]
-        
-        # Download video
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(request.url, download=True)
-            title = info.get('title', 'video')
-            
-            # Find the downloaded file
-            downloaded_files = list(DOWNLOAD_DIR.glob(f'{file_id}.*'))
-            if not downloaded_files:
-                raise HTTPException(status_code=500, detail="Download failed")
-            
-            file_path = downloaded_files[0]
-            
-            # Clean filename
-            safe_title = "".join(c for c in title if c.isalnum() or c in (' ', '-', '_')).strip()
-            ext = file_path.suffix
-            
-            # Schedule file deletion after sending
-            background_tasks.add_task(cleanup_file, file_path)
-            
-            return FileResponse(
-                path=file_path,
-                filename=f"{safe_title}{ext}",
-                media_type='application/octet-stream'
-            )
+def get_download_profile(format_type: str) -> str:
+    """Name of the tuning profile for a format key"""
+    return FORMAT_PROFILES.get(normalize_format(format_type), DEFAULT_PROFILE)
+
+def apply_download_profile(ydl_opts: dict, profile_name: str, external: bool = True) -> dict:
+    """Add the throughput options of a tuning profile to yt-dlp options"""
+    profile = dict(DOWNLOAD_PROFILES.get(profile_name, {}))
+    downloader = profile.pop("external_downloader", None)
+    ydl_opts.update(profile)
     
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+    if external and downloader and shutil.which(downloader):
+        connections = str(profile.get("concurrent_fragment_downloads", 1))
+        ydl_opts['external_downloader'] = {'default': downloader}
+        if downloader == "aria2c":
+            ydl_opts['external_downloader_args'] = {'aria2c': ['-x', connections, '-s', connections, '-k', '1M']}
+    return ydl_opts
+
+def base_ydl_opts() -> dict:
+    """yt-dlp options shared by extraction and downloads"""
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': False,
+        # Anti-bot detection measures
+        'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+        'referer': 'https://www.youtube.com/',
+        'http_headers': {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Language': 'en-us,en;q=0.5',
+            'Sec-Fetch-Mode': 'navigate',
+        },
+        'allowed_extractors': YDL_EXTRACTORS,
+    }
+    
+    # Cookies are not an option: YDLPool hands each instance a shared jar
+    return ydl_opts
+
+class CookieJars:
+    """Uploaded cookie jars, parsed once per worker and shared in memory by all requests.
+
+    Each jar is written once as ``{name}.{version}.txt`` and never changed.
+    ``manifest.json`` maps jar names to their files and carries a version
+    number that every change increments. It is replaced with an atomic rename
+    after the jar file is in place, so readers see the old or the new set of
+    jars, never a half-written file. Workers notice a new manifest from its
+    stat, checked at most every COOKIE_REFRESH_SECONDS, and only parse jars
+    that changed. Requests take the jars round-robin, spreading the request
+    rate over several accounts.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        self.manifest = root / "manifest.json"
+        self.lock = threading.Lock()
+        self.current = (0, (), {})  # (version, names, name -> (file name, jar)), replaced as a whole
+        self.stamp = None
+        self.checked = 0.0
+        self.turn = itertools.count()
+        if not self.manifest.exists() and COOKIES_FILE.exists():
+            try:
+                self.publish("default", COOKIES_FILE.read_bytes())
+                COOKIES_FILE.unlink()
+            except ValueError:
+                pass
+        self.refresh(force=True)
+
+    @staticmethod
+    def parse(data: bytes) -> yt_dlp.cookies.YoutubeDLCookieJar:
+        """Parse and validate a Netscape cookies file"""
+        try:
+            text = data.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise ValueError("Cookies file is not UTF-8 text")
+        # yt-dlp skips malformed lines with a warning; reject them instead,
+        # saying which line is wrong
+        lines = text.splitlines()
+        if text.lstrip()[:1] in ("[", "{"):
+            raise ValueError("Cookies file is JSON, export it in the Netscape cookies.txt format")
+        if not lines or not re.search(r"#( Netscape)? HTTP Cookie File", lines[0]):
+            raise ValueError('Line 1: expected the "# Netscape HTTP Cookie File" header')
+        for number, line in enumerate(lines, 1):
+            line = line.removeprefix("#HttpOnly_")
+            if line.startswith("#") or not line.strip():
+                continue
+            fields = line.split("\t")
+            if len(fields) != 7:
+                raise ValueError(f"Line {number}: expected 7 tab-separated fields, found {len(fields)}")
+            if fields[4] and not re.fullmatch(r"[0-9]+(?:\.[0-9]+)?", fields[4]):
+                raise ValueError(f"Line {number}: invalid expiry time {fields[4]!r}")
+        jar = yt_dlp.cookies.YoutubeDLCookieJar()
+        try:
+            jar.load(io.StringIO(text))
+        except http.cookiejar.LoadError:
+            raise ValueError("Cookies file is not in the Netscape cookies.txt format")
+        if not len(jar):
+            raise ValueError("No cookies found, export them in the Netscape cookies.txt format")
+        return jar
+
+    @staticmethod
+    def describe(name: str, jar) -> dict:
+        now = time.time()
+        return {
+            "name": name,
+            "cookies": len(jar),
+            "expired": sum(1 for cookie in jar if cookie.expires and cookie.expires < now),
+            "youtube": any(cookie.domain.lstrip(".").endswith("youtube.com") for cookie in jar),
+        }
+
+    @property
+    def version(self) -> int:
+        return self.current[0]
+
+    def _read_manifest(self) -> dict:
+        try:
+            return json.loads(self.manifest.read_text())
+        except FileNotFoundError:
+            return {"version": 0, "jars": {}}
+
+    def _write_manifest(self, manifest: dict):
+        tmp = self.root / f".{uuid.uuid4().hex}.json"
+        tmp.write_text(json.dumps(manifest))
+        os.replace(tmp, self.manifest)
+
+    def refresh(self, force: bool = False):
+        """Load the jars of a new manifest, if there is one"""
+        now = time.monotonic()
+        if not force and now - self.checked < COOKIE_REFRESH_SECONDS:
+            return
+        self.checked = now
+        try:
+            stat = self.manifest.stat()
+            stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self.stamp:
+            return
+        
+        with self.lock:
+            manifest = self._read_manifest()
+            jars = {}
+            for name, file_name in manifest["jars"].items():
+                known = self.current[2].get(name)
+                if known and known[0] == file_name:
+                    jars[name] = known
+                    continue
+                try:
+                    jars[name] = (file_name, self.parse((self.root / file_name).read_bytes()))
+                except (OSError, ValueError):
+                    continue  # replaced in the meantime; the newer manifest is picked up next time
+            self.current = (manifest["version"], tuple(sorted(jars)), jars)
+            self.stamp = stamp
+
+    def pick(self) -> tuple:
+        """The next jar round-robin, as (version, name, jar); (version, None, None) without cookies"""
+        self.refresh()
+        version, names, jars = self.current
+        if not names:
+            return version, None, None
+        name = names[next(self.turn) % len(names)]
+        return version, name, jars[name][1]
+
+    def publish(self, name: str, data: bytes) -> dict:
+        """Validate a cookies file and make it the current version of a jar"""
+        if not re.fullmatch(r'[\w-]{1,64}', name):
+            raise ValueError("Jar names may only contain letters, digits, '-' and '_'")
+        jar = self.parse(data)
+        with file_lock("cookies"):
+            manifest = self._read_manifest()
+            manifest["version"] += 1
+            file_name = f"{name}.{manifest['version']}.txt"
+            tmp = self.root / f".{uuid.uuid4().hex}.txt"
+            tmp.write_bytes(data)
+            os.replace(tmp, self.root / file_name)
+            replaced = manifest["jars"].get(name)
+            manifest["jars"][name] = file_name
+            self._write_manifest(manifest)
+            if replaced:
+                cleanup_file(self.root / replaced)
+        self.refresh(force=True)
+        return self.describe(name, jar)
+
+    def remove(self, name: Optional[str] = None) -> bool:
+        """Delete one jar, or all of them; False if there was nothing to delete"""
+        with file_lock("cookies"):
+            manifest = self._read_manifest()
+            removed = [n for n in manifest["jars"] if name is None or n == name]
+            if not removed:
+                return False
+            manifest["version"] += 1
+            files = [manifest["jars"].pop(n) for n in removed]
+            self._write_manifest(manifest)
+            for file_name in files:
+                cleanup_file(self.root / file_name)
+        self.refresh(force=True)
+        return True
+
+    def status(self) -> dict:
+        self.refresh()
+        version, names, jars = self.current
+        file_size = 0
+        for name in names:
+            try:
+                file_size += (self.root / jars[name][0]).stat().st_size
+            except FileNotFoundError:
+                pass  # replaced meanwhile
+        return {
+            "version": version,
+            "file_size": file_size,  # of all jars, as before there were several
+            "jars": [self.describe(name, jars[name][1]) for name in names],
+        }
+
+cookie_jars = CookieJars(COOKIES_DIR)
+
+class YDLPool:
+    """Warm YoutubeDL instances, reused per option profile and cookie jar.
+
+    Building a YoutubeDL registers every extractor, and each instance keeps
+    its own keep-alive HTTP connections and extractor caches (e.g. YouTube
+    player JS and signature functions). Instances are checked out
+    exclusively, keyed by their options minus the per-request ones below,
+    which are applied on checkout, and by the cookie jar picked for the
+    request. Instances use the shared in-memory jar, so no cookie file is read
+    or written. All instances are dropped when the cookie jars change, in this
+    or any other worker.
+    """
+
+    REQUEST_OPTIONS = ('format', 'outtmpl', 'progress_hooks', 'postprocessor_hooks', 'postprocessors',
+                       'download_ranges', 'force_keyframes_at_cuts')
+
+    def __init__(self, size: int):
+        self.size = size
+        self.idle = {}  # (jar name, profile key) -> [YoutubeDL]
+        self.version = cookie_jars.version
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def get(self, ydl_opts: dict):
+        """Check out a YoutubeDL configured with ydl_opts and the next cookie jar"""
+        base = {k: v for k, v in ydl_opts.items() if k not in self.REQUEST_OPTIONS}
+        version, jar_name, jar = cookie_jars.pick()
+        key = (jar_name, json.dumps(base, sort_keys=True, default=repr))
+        with self.lock:
+            if version != self.version:
+                self._invalidate(version)
+            idle = self.idle.get(key)
+            ydl = idle.pop() if idle else None
+        
+        if ydl is None:
+            ydl = yt_dlp.YoutubeDL(dict(ydl_opts))
+            if jar is not None:
+                ydl.cookiejar = jar  # before the first request builds the HTTP handlers
+        else:
+            self._configure(ydl, ydl_opts)
+        try:
+            yield ydl
+        except yt_dlp.utils.DownloadError:
+            self._release(key, ydl, version)  # reported errors leave the instance usable
+            raise
+        except BaseException:
+            self._discard(ydl)
+            raise
+        self._release(key, ydl, version)
+
+    def _release(self, key: tuple, ydl, version: int):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if version == self.version and len(idle) < self.size:
+                idle.append(ydl)
+                return
+        self._discard(ydl)
+
+    def warm(self, ydl_opts: dict):
+        """Build an instance ahead of the first request"""
+        with self.get(ydl_opts):
+            pass
+
+    def invalidate(self):
+        """Drop all idle instances (the cookies were changed)"""
+        with self.lock:
+            self._invalidate(cookie_jars.version)
+
+    def _invalidate(self, version: int):
+        idle, self.idle = self.idle, {}
+        self.version = version
+        for ydl in itertools.chain.from_iterable(idle.values()):
+            self._discard(ydl)
+
+    @staticmethod
+    def _configure(ydl, ydl_opts: dict):
+        """Apply the per-request options the way YoutubeDL.__init__ does"""
+        for k in YDLPool.REQUEST_OPTIONS:
+            # Unset rather than None, yt-dlp reads some of them with a default
+            if k in ydl_opts:
+                ydl.params[k] = ydl_opts[k]
+            else:
+                ydl.params.pop(k, None)
+        ydl.params['outtmpl'] = ydl_opts.get('outtmpl') or {}
+        ydl._parse_outtmpl()
+        fmt = ydl.params.get('format')
+        ydl.format_selector = fmt if fmt in (None, '-') or callable(fmt) else ydl.build_format_selector(fmt)
+        ydl._progress_hooks = []
+        ydl._postprocessor_hooks = []
+        ydl._pps = {when: [] for when in yt_dlp.utils.POSTPROCESS_WHEN}
+        ydl._num_downloads = 0
+        for hook in ydl_opts.get('progress_hooks') or []:
+            ydl.add_progress_hook(hook)
+        for hook in ydl_opts.get('postprocessor_hooks') or []:
+            ydl.add_postprocessor_hook(hook)
+        for pp_def in ydl_opts.get('postprocessors') or []:
+            pp_def = dict(pp_def)
+            when = pp_def.pop('when', 'post_process')
+            ydl.add_post_processor(yt_dlp.postprocessor.get_postprocessor(pp_def.pop('key'))(ydl, **pp_def), when=when)
+
+    @staticmethod
+    def _discard(ydl):
+        try:
+            ydl.close()
+        except Exception:
+            pass
+
+ydl_pool = YDLPool(YDL_POOL_SIZE)
+
+# yt-dlp reports most origin failures as text, e.g. an ExtractorError for the
+# bot check or a DownloadError wrapping "HTTP Error 429: Too Many Requests"
+THROTTLED_ERROR = re.compile(r"HTTP Error 429|Too Many Requests|confirm you.re not a bot|rate.?limit", re.IGNORECASE)
+NETWORK_ERROR = re.compile(
+    r"HTTP Error 5\d\d|timed out|Connection (reset|refused|aborted)|Remote end closed|IncompleteRead"
+    r"|Temporary failure in name resolution|EOF occurred", re.IGNORECASE,
+)
+TRANSIENT_ERRORS = ("throttled", "network")
+
+def classify_error(error: BaseException) -> str:
+    """'throttled', 'network' or 'permanent', from the error and the exceptions it wraps"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, HTTPException):
+            return "throttled" if error.status_code == 503 else "permanent"
+        if THROTTLED_ERROR.search(str(error)):
+            return "throttled"
+        if isinstance(error, yt_dlp.networking.exceptions.HTTPError):
+            if error.status == 429:
+                return "throttled"
+            if error.status >= 500:
+                return "network"
+        elif isinstance(error, (ConnectionError, TimeoutError, yt_dlp.networking.exceptions.TransportError)):
+            if not isinstance(error, yt_dlp.networking.exceptions.CertificateVerifyError):
+                return "network"
+        elif NETWORK_ERROR.search(str(error)):
+            return "network"
+        exc_info = getattr(error, 'exc_info', None)
+        error = getattr(error, 'cause', None) or (exc_info and exc_info[1]) or error.__cause__ or error.__context__
+    return "permanent"
+
+def retry_delay(attempt: int) -> float:
+    """Backoff before retry number attempt (from 1), with full jitter"""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+class CircuitBreaker:
+    """Stops calling the origin, for the whole process, while it throttles us.
+
+    Closed, calls go through and throttling errors (HTTP 429, the "confirm
+    you're not a bot" check) are counted. When BREAKER_THRESHOLD of them
+    happen within BREAKER_WINDOW seconds the breaker opens: calls fail fast
+    with 503 and a Retry-After of the remaining cooldown, instead of making
+    the throttling worse. After the cooldown a single probe call is let
+    through (half-open). If it is not throttled the breaker closes, otherwise
+    it opens again for twice as long, up to BREAKER_MAX_COOLDOWN.
+    """
+
+    def __init__(self, threshold: int, window: float, cooldown: float, max_cooldown: float):
+        self.threshold = threshold
+        self.window = window
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = collections.deque()  # monotonic times of recent throttling errors
+        self.open_until = 0.0
+        self.probing = False
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    def retry_after(self) -> int:
+        """Seconds until calls may succeed again"""
+        if self.state == "open":
+            return max(1, math.ceil(self.open_until - time.monotonic()))
+        return max(1, math.ceil(self.cooldown / 4)) if self.state == "half-open" else RETRY_AFTER
+
+    def check(self) -> bool:
+        """Raise 503 while open; returns True for the probe call of the half-open state"""
+        if not self.threshold:
+            return False
+        with self.lock:
+            if self.state == "closed":
+                return False
+            if self.state == "open" and time.monotonic() >= self.open_until:
+                self.state = "half-open"
+                self.probing = False
+            if self.state == "half-open" and not self.probing:
+                self.probing = True
+                return True
+            retry_after = self.retry_after()
+        self._reject(retry_after)
+
+    def blocked(self) -> bool:
+        """True while every call would be rejected: open and cooling down, or half-open with the probe out"""
+        if self.state == "open":
+            return time.monotonic() < self.open_until
+        return self.state == "half-open" and self.probing
+
+    def shed(self):
+        """Raise 503 while open, before a request waits for a worker slot; never takes the probe"""
+        if self.state == "open" and time.monotonic() < self.open_until:
+            self._reject(self.retry_after())
+
+    @staticmethod
+    def _reject(retry_after: int):
+        BREAKER_REJECTED.inc()
+        raise HTTPException(
+            status_code=503, detail="YouTube is throttling requests, try again later",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    def record(self, kind: str, probe: bool = False):
+        """Count the outcome of an origin call: "ok" or an error class"""
+        if not self.threshold:
+            return
+        with self.lock:
+            now = time.monotonic()
+            if probe:
+                self.probing = False
+                if kind == "throttled":
+                    self._open(now, min(self.max_cooldown, self.cooldown * 2))
+                else:
+                    self.state = "closed"
+                    self.cooldown = self.base_cooldown
+                    self.failures.clear()
+                    BREAKER_OPEN.set(0)
+            elif kind == "throttled" and self.state == "closed":
+                self.failures.append(now)
+                while self.failures and self.failures[0] < now - self.window:
+                    self.failures.popleft()
+                if len(self.failures) >= self.threshold:
+                    self._open(now, self.base_cooldown)
+
+    def _open(self, now: float, cooldown: float):
+        self.state = "open"
+        self.cooldown = cooldown
+        self.open_until = now + cooldown
+        self.failures.clear()
+        self.trips += 1
+        BREAKER_OPEN.set(1)
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                "state": self.state,
+                "recent_throttles": len(self.failures),
+                "retry_after": self.retry_after() if self.state != "closed" else 0,
+                "trips": self.trips,
+            }
+
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_WINDOW, BREAKER_COOLDOWN, BREAKER_MAX_COOLDOWN)
+
+def call_origin(func, *args, attempts: int = RETRY_ATTEMPTS):
+    """Run a yt-dlp call through the circuit breaker, retrying transient failures"""
+    attempt = 0
+    while True:
+        probe = breaker.check()
+        try:
+            result = func(*args)
+        except Exception as e:
+            kind = classify_error(e)
+            breaker.record(kind, probe)
+            ORIGIN_ERRORS.labels(kind).inc()
+            attempt += 1
+            if kind not in TRANSIENT_ERRORS or attempt >= attempts:
+                raise
+            delay = retry_delay(attempt)
+            current_span.get().event("retry", attempt=attempt, kind=kind, delay_s=round(delay, 3),
+                                     **{"exception.message": str(e)[:1000]})
+            time.sleep(delay)
+            continue
+        breaker.record("ok", probe)
+        return result
+
+def origin_error(error: Exception) -> HTTPException:
+    """Response for a failed request: 503 with Retry-After if trying again may help, else 400"""
+    if classify_error(error) in TRANSIENT_ERRORS:
+        return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": str(breaker.retry_after())})
+    return HTTPException(status_code=400, detail=str(error))
+
+def _download_blocking(url: str, format_type: str, file_id: str, job_id: Optional[str] = None,
+                       source: Optional[str] = None, section: Optional[tuple] = None,
+                       info: Optional[dict] = None) -> tuple:
+    """Run the yt-dlp download in a worker, returning (title, file path)"""
+    output_dir = JOBS_DIR if job_id else DOWNLOAD_DIR
+    format_key = normalize_format(format_type)
+    if info is None:
+        info = load_info(url, format_key)
+
+    # Determine if audio format (source streams are kept as downloaded)
+    audio_format = None if source else get_audio_format(format_type)
+    
+    # Configure yt-dlp options, with the exact formats planned from the
+    # cached extraction result when there is one
+    ydl_opts = base_ydl_opts()
+    ydl_opts['format'] = (
+        plan_format(info, source or format_key)
+        or (source_selector(source) if source else get_format_selector(format_type))
+    )
+    ydl_opts['outtmpl'] = str(output_dir / f'{file_id}.%(ext)s')
+    apply_download_profile(ydl_opts, get_download_profile(format_type))
+    
+    # Clips: ffmpeg seeks in the remote streams and only fetches the range
+    if section:
+        start, end, precise = section
+        ydl_opts['download_ranges'] = yt_dlp.utils.download_range_func(None, [(start, end)])
+        ydl_opts['force_keyframes_at_cuts'] = precise
+    
+    # Add audio conversion if needed
+    if audio_format:
+        ydl_opts['postprocessors'] = [{
+            'key': 'FFmpegExtractAudio',
+            'preferredcodec': audio_format,
+            'preferredquality': '320' if audio_format == 'mp3' else '0',
+        }]
+    
+    # Record metrics and report progress to the job queue
+    metrics = DownloadMetrics(format_key)
+    ydl_opts['progress_hooks'] = [metrics.on_download]
+    ydl_opts['postprocessor_hooks'] = [metrics.on_postprocess]
+    if job_id:
+        progress = JobProgress(job_id)
+        ydl_opts['progress_hooks'].append(progress.on_download)
+        ydl_opts['postprocessor_hooks'].append(progress.on_postprocess)
+    
+    # Download video, reusing the cached extraction result when there is one
+    # (a copy, as yt-dlp adds the selected formats to it)
+    def download() -> str:
+        try:
+            with ydl_pool.get(ydl_opts) as ydl:
+                if info.get('_type', 'video') == 'video':
+                    return ydl.process_ie_result(copy.deepcopy(info), download=True).get('title', 'video')
+                return ydl.extract_info(url, download=True).get('title', 'video')
+        finally:
+            spans.close()
+    
+    started = time.monotonic()
+    with span("download", format=format_key, selector=ydl_opts['format'], section=section and clip_name(section)) as download_span:
+        spans = DownloadSpans(download_span)
+        if download_span:
+            ydl_opts['progress_hooks'].append(spans.on_download)
+            ydl_opts['postprocessor_hooks'].append(spans.on_postprocess)
+        try:
+            title = call_origin(download)
+        except Exception:
+            DOWNLOADS.labels(format_key, "error").inc()
+            raise
+    DOWNLOADS.labels(format_key, "ok").inc()
+    STAGE_SECONDS.labels("download", format_key).observe(time.monotonic() - started - metrics.postprocess_seconds)
+    
+    # Find the downloaded file
+    downloaded_files = list(output_dir.glob(f'{file_id}.*'))
+    if not downloaded_files:
+        raise RuntimeError("Download failed")
+    
+    return title, str(downloaded_files[0])
+
+class DownloadMetrics:
+    """yt-dlp hooks that record downloaded bytes and postprocessing time"""
+
+    def __init__(self, format_key: str):
+        self.format_key = format_key
+        self.postprocess_started = {}
+        self.postprocess_seconds = 0.0
+
+    def on_download(self, d: dict):
+        if d['status'] == 'finished':
+            DOWNLOADED_BYTES.labels(self.format_key).inc(d.get('total_bytes') or d.get('downloaded_bytes') or 0)
+
+    def on_postprocess(self, d: dict):
+        name = d.get('postprocessor')
+        if d['status'] == 'started':
+            self.postprocess_started[name] = time.monotonic()
+        elif d['status'] == 'finished' and name in self.postprocess_started:
+            seconds = time.monotonic() - self.postprocess_started.pop(name)
+            self.postprocess_seconds += seconds
+            STAGE_SECONDS.labels("postprocess", self.format_key).observe(seconds)
+
+class DownloadSpans:
+    """yt-dlp hooks that add spans for each fetched file, its fragments and each postprocessor.
+
+    yt-dlp counts the finished fragments of a file; a fragment span lasts
+    from one count to the next, so with concurrent fragment downloads it is
+    the time between completions rather than the latency of one request.
+    """
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.files = {}  # file name -> [file span, fragment span, fragments done, bytes at fragment start]
+        self.postprocessors = {}  # name -> span
+        self.lock = threading.Lock()
+
+    def on_download(self, d: dict):
+        with self.lock:
+            name = d.get('filename')
+            state = self.files.get(name)
+            if state is None:
+                info = d.get('info_dict') or {}
+                fetch = self.parent.child(
+                    "fetch", format_id=info.get('format_id'), protocol=info.get('protocol'),
+                    fragments=d.get('fragment_count'),
+                )
+                state = self.files[name] = [fetch, None, d.get('fragment_index') or 0, 0]
+            fetch, fragment, done, fragment_start = state
+            downloaded = d.get('downloaded_bytes') or 0
+            index = d.get('fragment_index')
+            if fragment and (index or 0) > done:
+                fragment.set(bytes=downloaded - fragment_start, completed=index - done)
+                fragment.finish()
+                fragment, done, fragment_start = None, index, downloaded
+                state[1:] = fragment, done, fragment_start
+            count = d.get('fragment_count')
+            if d['status'] == 'downloading' and index is not None and fragment is None and not (count and done >= count):
+                state[1] = fetch.child("fragment", index=done)
+            elif d['status'] in ('finished', 'error'):
+                if fragment:
+                    fragment.finish()
+                fetch.set(bytes=d.get('total_bytes') or downloaded, status=d['status'])
+                fetch.finish()
+                del self.files[name]
+
+    def on_postprocess(self, d: dict):
+        name = d.get('postprocessor')
+        with self.lock:
+            if d['status'] == 'started':
+                self.postprocessors[name] = self.parent.child(f"postprocess {name}")
+            elif d['status'] == 'finished' and name in self.postprocessors:
+                self.postprocessors.pop(name).finish()
+
+    def close(self):
+        """Finish the spans of a download attempt that was interrupted"""
+        with self.lock:
+            for fetch, fragment, _, _ in self.files.values():
+                for unfinished in (fragment, fetch):
+                    if unfinished:
+                        unfinished.set(status="interrupted")
+                        unfinished.finish()
+            for postprocessor in self.postprocessors.values():
+                postprocessor.set(status="interrupted")
+                postprocessor.finish()
+            self.files.clear()
+            self.postprocessors.clear()
+
+# Source streams shared by the derived formats: name -> yt-dlp selector
+SOURCE_SELECTORS = {
+    "audio": "bestaudio/best",
+    "audio-m4a": "bestaudio[ext=m4a]/bestaudio/best",
+}
+VIDEO_HEIGHTS = {
+    "144p": 144, "240p": 240, "360p": 360, "480p": 480,
+    "720p": 720, "1080p": 1080, "1440p": 1440, "4k": 2160,
+}
+
+# ffmpeg settings for derived audio, matching FFmpegExtractAudio with the
+# download qualities: (extension, source extension that is copied instead of
+# transcoded, codec args, container args). webm is not among them: it is the
+# webm audio stream (or the best audio) as downloaded, never converted.
+DERIVED_AUDIO = {
+    "mp3": (".mp3", None, ["-c:a", "libmp3lame", "-b:a", "320k"], []),
+    "m4a": (".m4a", ".m4a", ["-c:a", "aac", "-q:a", "4"], ["-bsf:a", "aac_adtstoasc"]),
+    "aac": (".m4a", ".m4a", ["-c:a", "aac", "-q:a", "4"], ["-f", "adts"]),
+    "flac": (".flac", None, ["-c:a", "flac"], []),
+    "opus": (".opus", ".webm", ["-c:a", "libopus"], []),
+    "ogg": (".ogg", None, ["-c:a", "libvorbis", "-q:a", "10"], []),
+    "wav": (".wav", None, [], ["-f", "wav"]),
+}
+DERIVED_SOURCES = {"m4a": "audio-m4a", "aac": "audio-m4a"}  # everything else uses "audio"
+
+def source_selector(source: str) -> str:
+    """yt-dlp selector for a source stream"""
+    return SOURCE_SELECTORS.get(source) or f"bestvideo[height<={source.split('-')[1]}]"
+
+class SourceUnavailable(Exception):
+    """The format cannot be built from separate source streams"""
+
+@contextmanager
+def cpu_slot():
+    """Hold one of TRANSCODE_WORKERS slots shared by all worker processes"""
+    while True:
+        for slot in range(TRANSCODE_WORKERS):
+            f = open(LOCKS_DIR / f"cpu-{slot}.lock", "w")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                continue
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+                f.close()
+            return
+        time.sleep(0.1)
+
+def run_ffmpeg(args: list):
+    """Run ffmpeg once a CPU slot is free; the last argument is the output file"""
+    with span("ffmpeg", args=" ".join(map(str, args))) as ffmpeg_span:
+        waited = time.monotonic()
+        with cpu_slot():
+            ffmpeg_span.set(cpu_wait_s=round(time.monotonic() - waited, 3))
+            result = subprocess.run(
+                ["ffmpeg", "-y", "-nostdin", "-loglevel", "error", *map(str, args)],
+                capture_output=True, text=True,
+            )
+        if result.returncode != 0:
+            Path(args[-1]).unlink(missing_ok=True)
+            raise RuntimeError(f"ffmpeg failed: {result.stderr.strip()[-500:]}")
+
+def source_cache_key(info: dict, source: str) -> str:
+    """Cache name of a source stream, after the format it resolves to when the formats are known.
+
+    Height caps that pick the same stream (1080p, 1440p and 4k of a 1080p
+    video) then share one download.
+    """
+    format_id = plan_format(info, source)
+    return "source-" + (re.sub(r"[^\w-]", "_", format_id) if format_id else source)
+
+def ensure_source(url: str, key: str, source: str, format_type: str, job_id: Optional[str] = None,
+                  info: Optional[dict] = None) -> tuple:
+    """Download a source stream into the cache once, returning (path, title)"""
+    if info is None:
+        info = load_info(url, normalize_format(format_type))
+    cache_key = source_cache_key(info, source)
+    cached = result_cache.lookup(key, cache_key)
+    CACHE_LOOKUPS.labels("source", "hit" if cached else "miss").inc()
+    if cached:
+        return cached
+    
+    with file_lock(f"{key}.{cache_key}"):
+        cached = result_cache.lookup(key, cache_key) or restore_result(f"{key}.{cache_key}")
+        if cached:
+            return cached
+        try:
+            title, file_path = _download_blocking(
+                url, format_type, str(uuid.uuid4()), job_id=job_id, source=source, info=info,
+            )
+        # process_ie_result raises the ExtractorError itself, not a DownloadError
+        except yt_dlp.utils.YoutubeDLError as e:
+            if "Requested format is not available" in str(e):
+                raise SourceUnavailable(source) from e
+            raise
+        path = result_cache.store(key, cache_key, Path(file_path), title)
+        publish_result(path, title)
+        return path, title
+
+def transcode_audio(source: Path, format_key: str) -> Path:
+    """Build an audio format from a source stream, copying the codec when it fits"""
+    ext, copyable, codec_args, container_args = DERIVED_AUDIO[format_key]
+    output = DOWNLOAD_DIR / f"{uuid.uuid4()}{ext}"
+    if source.suffix == copyable:
+        try:
+            run_ffmpeg(["-i", source, "-vn", "-c:a", "copy", *container_args, output])
+            return output
+        except RuntimeError:
+            pass  # the codec does not fit the container after all
+    run_ffmpeg(["-i", source, "-vn", *codec_args, *container_args, output])
+    return output
+
+def mux_video(video: Path, audio: Path) -> Path:
+    """Combine video and audio streams without re-encoding"""
+    if video.suffix == ".mp4" and audio.suffix == ".m4a":
+        ext, extra = ".mp4", ["-movflags", "+faststart"]
+    elif video.suffix == ".webm" and audio.suffix == ".webm":
+        ext, extra = ".webm", []
+    else:
+        ext, extra = ".mkv", []
+    output = DOWNLOAD_DIR / f"{uuid.uuid4()}{ext}"
+    run_ffmpeg(["-i", video, "-i", audio, "-map", "0:v:0", "-map", "1:a:0", "-c", "copy", *extra, output])
+    return output
+
+def clip_spec(request: DownloadRequest) -> Optional[dict]:
+    """The clip a request asks for, checked but not yet resolved against the video"""
+    if request.start is None and request.end is None and not request.chapters:
+        return None
+    if request.chapters and (request.start is not None or request.end is not None):
+        raise HTTPException(status_code=400, detail="Give either start/end or chapters, not both")
+    if (request.start or 0) < 0 or (request.end is not None and request.end <= (request.start or 0)):
+        raise HTTPException(status_code=400, detail="A clip needs 0 <= start < end")
+    for pattern in request.chapters:
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            raise HTTPException(status_code=400, detail=f"Invalid chapter pattern {pattern!r}: {e}")
+    return {"start": request.start, "end": request.end, "chapters": request.chapters, "precise": request.precise_cuts}
+
+def clip_section(info: dict, clip: dict) -> Optional[tuple]:
+    """Resolve a clip to (start, end, precise) in seconds, or None if it covers the whole video.
+
+    Chapters select the span from the first to the last matching chapter.
+    """
+    if info.get('_type', 'video') != 'video':
+        raise ValueError("Clips are only available for single videos")
+    duration = info.get('duration')
+    if clip['chapters']:
+        chapters = [
+            chapter for chapter in info.get('chapters') or []
+            if any(re.search(pattern, chapter.get('title') or '', re.IGNORECASE) for pattern in clip['chapters'])
+        ]
+        if not chapters:
+            raise ValueError(f"No chapter matches {', '.join(clip['chapters'])}")
+        start, end = min(c['start_time'] for c in chapters), max(c['end_time'] for c in chapters)
+    else:
+        start, end = clip['start'] or 0, clip['end']
+    if duration:
+        if start >= duration:
+            raise ValueError(f"The clip starts after the end of the video ({duration:g} s)")
+        end = duration if end is None else min(end, duration)
+        if start <= 0 and end >= duration:
+            return None
+    elif end is None:
+        raise ValueError("The duration of the video is unknown, give an end time")
+    return round(start, 3), round(end, 3), clip['precise']
+
+def clip_name(section: tuple) -> str:
+    """Cache suffix of a clip, with times in milliseconds"""
+    start, end, precise = section
+    return f"{round(start * 1000)}-{round(end * 1000)}" + ("-exact" if precise else "")
+
+def cut_clip(source: Path, section: tuple) -> Path:
+    """Cut a time range out of a local file; without exact cuts, from the keyframe before start"""
+    start, end, precise = section
+    output = DOWNLOAD_DIR / f"{uuid.uuid4()}{source.suffix}"
+    run_ffmpeg(["-ss", start, "-i", source, "-t", round(end - start, 3), *([] if precise else ["-c", "copy"]), output])
+    return output
+
+def _clip_blocking(url: str, format_type: str, key: str, section: tuple, job_id: Optional[str] = None,
+                   info: Optional[dict] = None) -> tuple:
+    """Cut a clip out of the cached full result, or download only its range, returning (title, file path)"""
+    format_key = normalize_format(format_type)
+    cached = result_cache.lookup(key, format_key)
+    CACHE_LOOKUPS.labels("clip", "hit" if cached else "miss").inc()
+    if cached is None:
+        return _download_blocking(
+            url, format_type, job_id or str(uuid.uuid4()), job_id=job_id, section=section, info=info,
+        )
+    
+    source, title = cached
+    if job_id:
+        job_queue.update(job_id, stage="postprocessing (ffmpeg)")
+    with STAGE_SECONDS.labels("postprocess", format_key).time():
+        return title, str(cut_clip(source, section))
+
+def _derive_blocking(url: str, format_type: str, key: str, job_id: Optional[str] = None,
+                     info: Optional[dict] = None) -> tuple:
+    """Build a format from cached source streams, returning (title, file path)"""
+    format_key = normalize_format(format_type)
+    if format_key in DERIVED_AUDIO:
+        source, title = ensure_source(url, key, DERIVED_SOURCES.get(format_key, "audio"), format_type, job_id, info)
+        build = functools.partial(transcode_audio, source, format_key)
+    elif format_key in VIDEO_HEIGHTS:
+        video, title = ensure_source(url, key, f"video-{VIDEO_HEIGHTS[format_key]}", format_type, job_id, info)
+        audio, _ = ensure_source(url, key, "audio-m4a" if video.suffix == ".mp4" else "audio", format_type, job_id, info)
+        build = functools.partial(mux_video, video, audio)
+    else:
+        raise SourceUnavailable(format_key)
+    
+    if job_id:
+        job_queue.update(job_id, stage="postprocessing (ffmpeg)")
+    with STAGE_SECONDS.labels("postprocess", format_key).time():
+        return title, str(build())
+
+def reserve_download(info: dict, format_key: str, section: Optional[tuple] = None):
+    """Reserve storage for a download, sized from its extraction result"""
+    estimate = estimate_size(info, format_key)
+    if section and info.get('duration'):
+        estimate = max(1, int(estimate * (section[1] - section[0]) / info['duration']))
+    return storage.reserve(estimate)
+
+def _fetch_blocking(url: str, format_type: str, job_id: Optional[str] = None, clip: Optional[dict] = None) -> tuple:
+    """Get a result from the cache or download it, returning (title, file path, temporary)"""
+    key = video_key(url)
+    format_key = normalize_format(format_type)
+    # Extracted once here and passed down: URLs without a video key are not
+    # in the metadata cache, so every load_info() would extract them again
+    info = load_info(url, format_key) if clip or not key or not result_cache.enabled else None
+    section = clip_section(info, clip) if clip else None
+    if not key or not result_cache.enabled:
+        with reserve_download(info, format_key, section):
+            title, file_path = _download_blocking(
+                url, format_type, job_id or str(uuid.uuid4()), job_id=job_id, section=section, info=info,
+            )
+        if job_id is None and ARTIFACT_GRACE_SECONDS > 0:
+            path = keep_artifact(Path(file_path), title)
+            publish_result(path, title)
+            return title, str(path), False
+        if job_id:
+            publish_result(Path(file_path), title)
+        return title, file_path, job_id is None
+    
+    # Only one worker process downloads a given result; the others wait for
+    # the lock and then find it in the cache. Clips are cached like formats.
+    cache_key = f"{format_key}@{clip_name(section)}" if section else format_key
+    with file_lock(f"{key}.{cache_key}"):
+        cached = result_cache.lookup(key, cache_key)
+        CACHE_LOOKUPS.labels("result", "hit" if cached else "miss").inc()
+        # Another node may have downloaded it already
+        cached = cached or restore_result(f"{key}.{cache_key}")
+        if cached:
+            path, title = cached
+            return title, str(path), False
+        
+        if info is None:
+            info = load_info(url, format_key)
+        with reserve_download(info, format_key, section):
+            if section:
+                title, file_path = _clip_blocking(url, format_type, key, section, job_id, info)
+            else:
+                try:
+                    title, file_path = _derive_blocking(url, format_type, key, job_id, info)
+                except SourceUnavailable:
+                    # No separate streams (or no known recipe): download in one go
+                    title, file_path = _download_blocking(
+                        url, format_type, job_id or str(uuid.uuid4()), job_id=job_id, info=info,
+                    )
+        path = result_cache.store(key, cache_key, Path(file_path), title)
+        publish_result(path, title)
+        return title, str(path), False
+
+# Preferred container of audio-only formats, as in get_format_selector
+PLAN_AUDIO_EXTS = {"m4a": "m4a", "webm": "webm", "opus": "opus", "ogg": "ogg", "audio-m4a": "m4a"}
+
+class FormatTable:
+    """Compact column-wise table of a video's formats, used to plan downloads.
+
+    yt-dlp lists formats from worst to best, so the best format matching a
+    filter is the last one, which is what its ``bestvideo[height<=N]``-style
+    selectors pick. Planning a format key against the table gives the exact
+    format id (e.g. ``137+140``) and expected size without the info dict.
+    Expected sizes fall back to estimates; ``filesizes`` keeps yt-dlp's exact
+    ``filesize`` (0 when unknown) for reporting.
+    """
+
+    __slots__ = ('summary', 'ids', 'exts', 'notes', 'kinds', 'heights', 'sizes', 'filesizes')
+
+    MUXED, VIDEO, AUDIO, OTHER = range(4)
+    SUMMARY_FIELDS = ('title', 'duration', 'thumbnail', 'uploader', 'view_count', 'chapters')
+
+    def __init__(self, summary: dict, ids: list, exts: list, notes: list, kinds: bytes, heights, sizes, filesizes):
+        self.summary = summary
+        self.ids = ids
+        self.exts = exts
+        self.notes = notes
+        self.kinds = kinds
+        self.heights = array.array('i', heights)
+        self.sizes = array.array('q', sizes)
+        self.filesizes = array.array('q', filesizes)
+
+    @classmethod
+    def from_info(cls, info: dict) -> "FormatTable":
+        formats = info.get('formats') or []
+        duration = info.get('duration') or 0
+        
+        def kind(f: dict) -> int:
+            video, audio = f.get('vcodec') != 'none', f.get('acodec') != 'none'
+            return cls.MUXED if video and audio else cls.VIDEO if video else cls.AUDIO if audio else cls.OTHER
+        
+        def size(f: dict) -> int:
+            return int(f.get('filesize') or f.get('filesize_approx') or (f.get('tbr') or 0) * 125 * duration)
+        
+        return cls(
+            {name: info.get(name) for name in cls.SUMMARY_FIELDS},
+            [f.get('format_id') for f in formats],
+            [f.get('ext') for f in formats],
+            [f.get('format_note') for f in formats],
+            bytes(kind(f) for f in formats),
+            [f.get('height') or 0 for f in formats],
+            [size(f) for f in formats],
+            [int(f.get('filesize') or 0) for f in formats],
+        )
+
+    def dumps(self) -> str:
+        return json.dumps({
+            "summary": self.summary, "ids": self.ids, "exts": self.exts, "notes": self.notes,
+            "kinds": list(self.kinds), "heights": self.heights.tolist(), "sizes": self.sizes.tolist(),
+            "filesizes": self.filesizes.tolist(),
+        })
+
+    @classmethod
+    def loads(cls, data: str) -> "FormatTable":
+        d = json.loads(data)
+        return cls(
+            d["summary"], d["ids"], d["exts"], d["notes"], bytes(d["kinds"]), d["heights"], d["sizes"],
+            d.get("filesizes", [0] * len(d["ids"])),  # cached before exact sizes were kept
+        )
+
+    def best(self, kind: int, height: Optional[int] = None, ext: Optional[str] = None) -> Optional[int]:
+        """Index of the best format of a kind, optionally capped in height or limited to an ext"""
+        for i in range(len(self.ids) - 1, -1, -1):
+            if (self.kinds[i] == kind and (height is None or 0 < self.heights[i] <= height)
+                    and (ext is None or self.exts[i] == ext)):
+                return i
+        return None
+
+    def plan(self, name: str, progressive: bool = False) -> Optional[tuple]:
+        """Resolve a format key or source stream name to (format id, expected size, ext)"""
+        picks = None
+        height = VIDEO_HEIGHTS.get(name) or (int(name[6:]) if name.startswith("video-") else None)
+        if height:
+            video = None if progressive else self.best(self.VIDEO, height)
+            audio = self.best(self.AUDIO)
+            if name.startswith("video-"):
+                picks = [video] if video is not None else None
+            elif video is not None and audio is not None:
+                picks = [video, audio]
+            elif (muxed := self.best(self.MUXED, height)) is not None:
+                picks = [muxed]
+        elif name in DERIVED_AUDIO or name in SOURCE_SELECTORS or name in PLAN_AUDIO_EXTS:
+            ext = PLAN_AUDIO_EXTS.get(name)
+            audio = ext and self.best(self.AUDIO, ext=ext)
+            audio = audio if audio is not None else self.best(self.AUDIO)
+            audio = audio if audio is not None else self.best(self.MUXED)
+            picks = [audio] if audio is not None else None
+        elif (muxed := self.best(self.MUXED)) is not None:
+            picks = [muxed]
+        
+        if not picks:
+            return None
+        exts = [self.exts[i] for i in picks]
+        if name in DERIVED_AUDIO:
+            ext = DERIVED_AUDIO[name][0][1:]  # converted after the download
+        elif len(picks) > 1:
+            ext = "mp4" if exts == ["mp4", "m4a"] else "webm" if exts == ["webm", "webm"] else "mkv"
+        else:
+            ext = exts[0]
+        return "+".join(self.ids[i] for i in picks), sum(self.sizes[i] for i in picks), ext
+
+    def filesize(self, format_id: str) -> Optional[int]:
+        """Exact size of a (merged) format id, or None unless yt-dlp knows every part's size"""
+        sizes = [self.filesizes[self.ids.index(part)] for part in format_id.split("+")]
+        return sum(sizes) if all(sizes) else None
+
+def plan_format(info: dict, name: str, progressive: bool = False) -> Optional[str]:
+    """Exact format id for a format key or source stream, or None to let yt-dlp select"""
+    if info.get('_type', 'video') != 'video' or not info.get('formats'):
+        return None
+    planned = FormatTable.from_info(info).plan(name, progressive)
+    return planned and planned[0]
+
+class InfoCache:
+    """yt-dlp extraction results in the shared database, kept for a TTL.
+
+    Failed extractions are remembered for a shorter negative TTL, so repeated
+    requests for a broken or private video do not each go to YouTube.
+    """
+
+    def __init__(self):
+        with db_connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS info_cache (
+                    key TEXT PRIMARY KEY,
+                    info TEXT,
+                    error TEXT,
+                    expires_at REAL NOT NULL,
+                    formats TEXT
+                )
+            """)
+            # Databases created before the format table existed
+            try:
+                conn.execute("ALTER TABLE info_cache ADD COLUMN formats TEXT")
+            except sqlite3.OperationalError:
+                pass
+            conn.execute("CREATE INDEX IF NOT EXISTS info_cache_expiry ON info_cache (expires_at)")
+
+    def get(self, key: str) -> Optional[tuple]:
+        """Return (info, error) for a live entry, or None"""
+        with db_connect() as conn:
+            row = conn.execute(
+                "SELECT info, error FROM info_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return (json.loads(row['info']) if row['info'] else None), row['error']
+
+    def get_formats(self, key: str) -> Optional[FormatTable]:
+        """Format table of a live entry, without loading the info dict"""
+        with db_connect() as conn:
+            row = conn.execute(
+                "SELECT formats FROM info_cache WHERE key = ? AND expires_at > ? AND formats IS NOT NULL",
+                (key, time.time()),
+            ).fetchone()
+        return FormatTable.loads(row['formats']) if row else None
+
+    def put(self, key: str, info: Optional[dict] = None, error: Optional[str] = None):
+        now = time.time()
+        ttl = INFO_CACHE_TTL if error is None else INFO_CACHE_NEGATIVE_TTL
+        if ttl <= 0:
+            return
+        with db_connect() as conn:
+            conn.execute("DELETE FROM info_cache WHERE expires_at <= ?", (now,))
+            conn.execute(
+                "INSERT OR REPLACE INTO info_cache (key, info, error, expires_at, formats) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(info) if info is not None else None, error, now + ttl,
+                 FormatTable.from_info(info).dumps() if info is not None else None),
+            )
+
+    def clear_errors(self):
+        """Forget failures, e.g. after cookies change"""
+        with db_connect() as conn:
+            conn.execute("DELETE FROM info_cache WHERE error IS NOT NULL")
+
+info_cache = InfoCache()
+
+def _extract_once(url: str, format_key: str) -> dict:
+    with span("extract", url=url) as extract_span, STAGE_SECONDS.labels("extract", format_key).time(), ydl_pool.get(base_ydl_opts()) as ydl:
+        info = ydl.extract_info(url, download=False)
+        extract_span.set(extractor=info.get('extractor_key'), video_id=info.get('id'), formats=len(info.get('formats') or []))
+        # Drop the format selection of this run, like yt-dlp's --load-info-json,
+        # so the result can be processed again with another format
+        return ydl.sanitize_info(info, remove_private_keys=True)
+
+def _extract_info_blocking(url: str, format_key: str = "info") -> dict:
+    """Run yt-dlp metadata extraction in a worker"""
+    return call_origin(_extract_once, url, format_key)
+
+def load_info(url: str, format_key: str = "info") -> dict:
+    """Extraction result for a URL, from the metadata cache when possible"""
+    key = video_key(url)
+    if key is None:
+        return _extract_info_blocking(url, format_key)
+    
+    cached = info_cache.get(key)
+    CACHE_LOOKUPS.labels("info", "miss" if cached is None else "error" if cached[1] else "hit").inc()
+    if cached:
+        info, error = cached
+        if error:
+            raise yt_dlp.utils.DownloadError(error)
+        return info
+    
+    try:
+        info = _extract_info_blocking(url, format_key)
+    except yt_dlp.utils.DownloadError as e:
+        # Throttling and network errors say nothing about the video
+        if classify_error(e) == "permanent":
+            info_cache.put(key, error=str(e))
+        raise
+    # Playlists lose their entries when sanitized, so only videos are cached
+    if info.get('_type', 'video') == 'video':
+        info_cache.put(key, info)
+    return info
+
+def load_formats(url: str) -> FormatTable:
+    """Format table for a URL, from the metadata cache when possible"""
+    key = video_key(url)
+    table = key and info_cache.get_formats(key)
+    if table:
+        CACHE_LOOKUPS.labels("formats", "hit").inc()
+        return table
+    CACHE_LOOKUPS.labels("formats", "miss").inc()
+    return FormatTable.from_info(load_info(url))
+
+# ffmpeg settings for streamed audio: (codec args, container, extension)
+STREAM_AUDIO_OUTPUTS = {
+    "mp3": (["-c:a", "libmp3lame", "-b:a", "320k"], "mp3", ".mp3"),
+    "m4a": (["-c:a", "aac", "-b:a", "256k", "-movflags", "frag_keyframe+empty_moov"], "ipod", ".m4a"),
+    "aac": (["-c:a", "aac", "-b:a", "256k"], "adts", ".aac"),
+    "flac": (["-c:a", "flac"], "flac", ".flac"),
+    "opus": (["-c:a", "libopus"], "opus", ".opus"),
+    "vorbis": (["-c:a", "libvorbis", "-q:a", "10"], "ogg", ".ogg"),
+    "wav": (["-c:a", "pcm_s16le"], "wav", ".wav"),
+}
+
+def stream_cancel_marker(file_id: str) -> Path:
+    """File that tells the download of an abandoned stream to stop, in whichever process it runs"""
+    return DOWNLOAD_DIR / f'{file_id}-cancelled'
+
+def _check_stream_cancelled(file_id: str, d: dict):
+    if stream_cancel_marker(file_id).exists():
+        raise yt_dlp.utils.DownloadCancelled("Client disconnected")
+
+def _stream_download_blocking(info: dict, format_type: str, file_id: str):
+    """Download a single-file format without a .part file, so it can be read while it grows"""
+    ydl_opts = base_ydl_opts()
+    ydl_opts['format'] = plan_format(info, normalize_format(format_type), progressive=True) or get_stream_selector(format_type)
+    ydl_opts['outtmpl'] = str(DOWNLOAD_DIR / f'{file_id}.%(ext)s')
+    ydl_opts['nopart'] = True
+    ydl_opts['fixup'] = 'never'
+    # External downloaders write out of order, so the file could not be tailed
+    apply_download_profile(ydl_opts, get_download_profile(format_type), external=False)
+    ydl_opts['progress_hooks'] = [functools.partial(_check_stream_cancelled, file_id)]
+    
+    def download():
+        with storage.reserve(estimate_size(info, normalize_format(format_type))), ydl_pool.get(ydl_opts) as ydl:
+            ydl.process_ie_result(info, download=True)
+    with span("download", format=normalize_format(format_type), selector=ydl_opts['format'], stream=True) as download_span:
+        spans = DownloadSpans(download_span)
+        if download_span:
+            ydl_opts['progress_hooks'].append(spans.on_download)
+        try:
+            # Not retried, the client may already have part of the file
+            call_origin(download, attempts=1)
+        finally:
+            spans.close()
+
+async def tail_file(f, future: asyncio.Future):
+    """Yield the contents of an open file that is still being written until the writer finishes"""
+    finished = False
+    try:
+        while True:
+            chunk = await f.read(STREAM_CHUNK_SIZE)
+            if chunk:
+                yield chunk
+            elif finished:
+                # Aborts the response without its final chunk, so the client
+                # sees a truncated transfer rather than a complete file
+                if not future.cancelled() and future.exception():
+                    raise future.exception()
+                break
+            elif future.done():
+                finished = True  # one more pass for bytes written before it finished
+            else:
+                await asyncio.sleep(STREAM_POLL_INTERVAL)
+    finally:
+        await f.close()
+
+async def transcode_stream(source, args: list, container: str):
+    """Pipe a byte stream through ffmpeg and yield its output"""
+    proc = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-loglevel', 'error', '-i', 'pipe:0', '-vn', *args, '-f', container, 'pipe:1',
+        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+    )
+
+    async def feed():
+        try:
+            async for chunk in source:
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            proc.stdin.close()
+            await source.aclose()
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while chunk := await proc.stdout.read(STREAM_CHUNK_SIZE):
+            yield chunk
+        await feeder  # raises when the source failed
+        if await proc.wait():
+            raise RuntimeError(f"ffmpeg exited with status {proc.returncode}")
+    finally:
+        feeder.cancel()
+        if proc.returncode is None:
+            proc.kill()
+        await proc.wait()
+
+def cleanup_stream(file_id: str, future: asyncio.Future):
+    """Delete a streamed download once yt-dlp has stopped writing it"""
+    cleanup_file(stream_cancel_marker(file_id))
+    if not future.cancelled():
+        future.exception()  # failures after the first byte cannot be reported
+    for path in DOWNLOAD_DIR.glob(f'{file_id}.*'):
+        cleanup_file(path)
+
+async def stream_download(url: str, format_type: str, client: str = "", cost: float = 1) -> StreamingResponse:
+    """Start a download and stream the file to the client while it grows"""
+    info = await extract_executor.run(load_info, url, normalize_format(format_type))
+    if info.get('_type', 'video') != 'video':
+        raise HTTPException(status_code=400, detail="Streaming is only available for single videos")
+    
+    file_id = str(uuid.uuid4())
+    future = await download_executor.submit(_stream_download_blocking, info, format_type, file_id, client=client, cost=cost)
+    
+    # Wait for the first bytes, so errors before that still get a proper status
+    try:
+        while (path := next(DOWNLOAD_DIR.glob(f'{file_id}.*'), None)) is None:
+            if future.done():
+                future.result()
+                raise RuntimeError("Download failed")
+            await asyncio.sleep(STREAM_POLL_INTERVAL)
+    except BaseException:
+        future.add_done_callback(functools.partial(cleanup_stream, file_id))
+        raise
+    
+    # Open before cleanup is registered; the open file stays readable once deleted
+    f = await aiofiles.open(path, 'rb')
+    # Registered here rather than when the body ends, which never happens for
+    # a response that is not sent
+    future.add_done_callback(functools.partial(cleanup_stream, file_id))
+    body = tail_file(f, future)
+    ext = path.suffix
+    audio_format = get_audio_format(format_type)
+    if audio_format and ext != f'.{audio_format}':
+        args, container, ext = STREAM_AUDIO_OUTPUTS[audio_format]
+        body = transcode_stream(body, args, container)
+    
+    format_key = normalize_format(format_type)
+    
+    async def send():
+        started = time.monotonic()
+        try:
+            async for chunk in body:
+                SERVED_BYTES.labels(format_key).inc(len(chunk))
+                yield chunk
+        finally:
+            STAGE_SECONDS.labels("send", format_key).observe(time.monotonic() - started)
+            if not future.done():
+                stream_cancel_marker(file_id).touch()
+    
+    filename = safe_filename(info.get('title', 'video'), ext)
+    return StreamingResponse(
+        send(),
+        media_type='application/octet-stream',
+        headers={'Content-Disposition': f"attachment; filename*=utf-8''{quote(filename)}"},
+    )
+
+async def run_job(url: str, format_type: str, client: str, cost: float, clip: Optional[dict] = None) -> tuple:
+    """Download through the shared job queue and wait for the result, returning (title, file path, job id).
+
+    The least busy node claims the job; the result is then served from this
+    node, copied from the artifact store if another node downloaded it.
+    """
+    job_id = await asyncio.to_thread(job_queue.submit, url, format_type, client, cost, clip)
+    current_span.get().set(job_id=job_id)  # the job is traced where it runs
+    job_workers.wakeup.set()
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        job = await asyncio.to_thread(job_queue.get, job_id)
+        if job is None or job['state'] == 'failed':
+            raise RuntimeError(job['error'] if job else "Job was lost")
+        if job['state'] == 'finished':
+            file_path = await asyncio.to_thread(local_result, Path(job['file_path']))
+            if file_path is None:
+                raise RuntimeError("The result is not available on this node, configure ARTIFACT_STORE")
+            return job['title'], str(file_path), job_id
+
+@app.post("/download")
+async def download_video(request: DownloadRequest, background_tasks: BackgroundTasks, http_request: Request):
+    """Download video/audio in specified format"""
+    clip = clip_spec(request)
+    if clip and request.stream:
+        raise HTTPException(status_code=400, detail="Clips cannot be streamed")
+    cost = format_cost(request.format)
+    client = await admit(http_request, "download", cost)
+    try:
+        # Cache hits are served without taking a download slot (clips are
+        # looked up once their times are resolved)
+        key = video_key(request.url)
+        format_key = normalize_format(request.format)
+        cached = key and not clip and result_cache.lookup(key, format_key)
+        if not cached:
+            breaker.shed()  # rather than waiting for a download slot first
+        if cached:
+            CACHE_LOOKUPS.labels("result", "hit").inc()
+            file_path, title = cached
+        elif request.stream:
+            return await stream_download(request.url, request.format, client, cost)
+        elif job_queue.shared:
+            flight_key = (key, format_key, json.dumps(clip)) if key and result_cache.enabled else uuid.uuid4()
+            title, file_path, job_id = await download_flights.run(
+                flight_key, run_job, request.url, request.format, client, cost, clip,
+            )
+            file_path = Path(file_path)
+            return ArtifactResponse(
+                file_path, safe_filename(title, file_path.suffix),
+                content_location=f"/jobs/{job_id}/file", format_key=format_key,
+            )
+        else:
+            # Download in the worker pool so the event loop stays responsive;
+            # identical concurrent requests share one download
+            flight_key = (key, format_key, json.dumps(clip)) if key and result_cache.enabled else uuid.uuid4()
+            title, file_path, temporary = await download_flights.run(
+                flight_key, functools.partial(download_executor.run, client=client, cost=cost),
+                functools.partial(_fetch_blocking, clip=clip), request.url, request.format,
+            )
+            file_path = Path(file_path)
+            
+            # Schedule file deletion after sending (cached and kept results
+            # stay available at /files/{name})
+            if temporary:
+                background_tasks.add_task(cleanup_file, file_path)
+                return ArtifactResponse(file_path, safe_filename(title, file_path.suffix), format_key=format_key)
+        
+        return ArtifactResponse(
+            file_path, safe_filename(title, file_path.suffix),
+            content_location=f"/files/{file_path.name}", format_key=format_key,
+        )
+    
+    except Overloaded:
+        await refund(client, cost)
+        raise
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise origin_error(e)
 
 @app.get("/info")
 async def get_video_info(url: str):
     """Get video information without downloading"""
     try:
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': False,
-        }
+        table = await extract_executor.run(load_formats, url)
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            return {
-                "title": info.get('title'),
-                "duration": info.get('duration'),
-                "thumbnail": info.get('thumbnail'),
-                "uploader": info.get('uploader'),
-                "view_count": info.get('view_count'),
-                "formats": [
-                    {
-                        "format_id": f.get('format_id'),
-                        "ext": f.get('ext'),
-                        "quality": f.get('format_note'),
-                        "filesize": f.get('filesize'),
-                    }
-                    for f in info.get('formats', [])
-                ]
-            }
+        # What /download would fetch for each format key
+        plans = {}
+        for format_key in (*VIDEO_HEIGHTS, *DERIVED_AUDIO, "webm"):
+            if planned := table.plan(format_key):
+                format_id, size, ext = planned
+                plans[format_key] = {
+                    "format_id": format_id,
+                    "filesize": table.filesize(format_id),
+                    "filesize_approx": size or None,
+                    "ext": ext,
+                }
+        
+        return {
+            **table.summary,
+            "formats": [
+                {
+                    "format_id": table.ids[i],
+                    "ext": table.exts[i],
+                    "quality": table.notes[i],
+                    "filesize": table.filesizes[i] or None,
+                    "filesize_approx": table.sizes[i] or None,
+                }
+                for i in range(len(table.ids))
+            ],
+            "plans": plans,
+        }
     
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise origin_error(e)
+
+@app.api_route("/files/{name}", methods=["GET", "HEAD"])
+def get_file(name: str):
+    """Download a finished result again, with Range and ETag support"""
+    artifact = find_artifact(name)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="File not found or expired")
+    path, title = artifact
+    return ArtifactResponse(path, safe_filename(title, path.suffix), content_location=f"/files/{name}")
 
 def cleanup_file(file_path: Path):
     """Delete downloaded file after sending"""
@@ -552,22 +3421,834 @@ def cleanup_file(file_path: Path):
     except Exception:
         pass
 
+class JobQueue:
+    """Persistent download queue backed by the shared SQLite database"""
+
+    shared = False  # only the workers of this node take jobs
+
+    def __init__(self):
+        with db_connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    format TEXT NOT NULL,
+                    state TEXT NOT NULL,
+                    stage TEXT,
+                    progress REAL NOT NULL DEFAULT 0,
+                    downloaded_bytes INTEGER,
+                    total_bytes INTEGER,
+                    speed REAL,
+                    eta INTEGER,
+                    title TEXT,
+                    file_path TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    heartbeat REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    finished_at REAL,
+                    batch_id TEXT,
+                    client TEXT,
+                    cost REAL NOT NULL DEFAULT 1,
+                    fragment_index INTEGER,
+                    fragment_count INTEGER,
+                    clip TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS batches (
+                    id TEXT PRIMARY KEY,
+                    format TEXT NOT NULL,
+                    concurrency INTEGER NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            # Databases created before batches, admission control, fragment progress and clips existed
+            for column in ("batch_id TEXT", "client TEXT", "cost REAL NOT NULL DEFAULT 1",
+                           "fragment_index INTEGER", "fragment_count INTEGER", "clip TEXT"):
+                try:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column}")
+                except sqlite3.OperationalError:
+                    pass
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id, state)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_client ON jobs (client, state)")
+
+    def submit(self, url: str, format_type: str, client: Optional[str] = None, cost: float = 1,
+               clip: Optional[dict] = None) -> str:
+        """Queue a new job and return its id"""
+        return self.submit_many([url], format_type, client=client, cost=cost, clip=clip)[0]
+
+    def submit_many(self, urls: list, format_type: str, batch_id: Optional[str] = None,
+                    concurrency: int = 0, client: Optional[str] = None, cost: float = 1,
+                    clip: Optional[dict] = None) -> list:
+        """Queue jobs (optionally as one batch) and return their ids"""
+        job_ids = [uuid.uuid4().hex for _ in urls]
+        now = time.time()
+        with db_connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            (queued,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()
+            if queued + len(urls) > JOB_QUEUE_LIMIT:
+                conn.execute("ROLLBACK")
+                raise Overloaded("Job queue is full, try again later")
+            if client is not None:
+                (mine,) = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE client = ? AND state = 'queued'", (client,),
+                ).fetchone()
+                if mine + len(urls) > JOB_CLIENT_QUEUE_LIMIT:
+                    conn.execute("ROLLBACK")
+                    raise Overloaded("Too many queued jobs, wait for some to start", status_code=429)
+            if batch_id:
+                conn.execute(
+                    "INSERT INTO batches (id, format, concurrency, created_at) VALUES (?, ?, ?, ?)",
+                    (batch_id, format_type, concurrency, now),
+                )
+            # Spread created_at slightly so batch items keep their order
+            conn.executemany(
+                "INSERT INTO jobs (id, url, format, state, created_at, updated_at, batch_id, client, cost, clip)"
+                " VALUES (?, ?, ?, 'queued', ?, ?, ?, ?, ?, ?)",
+                [(job_id, url, format_type, now + i * 1e-6, now, batch_id, client, cost, clip and json.dumps(clip))
+                 for i, (job_id, url) in enumerate(zip(job_ids, urls))],
+            )
+            conn.execute("COMMIT")
+        return job_ids
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with db_connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def ids(self) -> set:
+        with db_connect() as conn:
+            return {row["id"] for row in conn.execute("SELECT id FROM jobs").fetchall()}
+
+    def counts(self) -> dict:
+        """Number of jobs by state"""
+        with db_connect() as conn:
+            return dict(conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """Atomically take the next queued job, fairly between clients"""
+        now = time.time()
+        with db_connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            # Batches may only run up to their own concurrency at a time, and
+            # the client with the least running cost goes first
+            row = conn.execute("""
+                SELECT jobs.* FROM jobs LEFT JOIN batches ON batches.id = jobs.batch_id
+                WHERE jobs.state = 'queued' AND (
+                    jobs.batch_id IS NULL OR batches.concurrency > (
+                        SELECT COUNT(*) FROM jobs AS running
+                        WHERE running.batch_id = jobs.batch_id AND running.state = 'running'
+                    )
+                )
+                ORDER BY (
+                    SELECT COALESCE(SUM(running.cost), 0) FROM jobs AS running
+                    WHERE running.client IS jobs.client AND running.state = 'running'
+                ), jobs.created_at LIMIT 1
+            """).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            conn.execute(
+                "UPDATE jobs SET state = 'running', stage = 'starting', worker = ?, heartbeat = ?,"
+                " attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (worker, now, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+        return {**dict(row), 'attempts': row['attempts'] + 1}
+
+    def list_batch(self, batch_id: str) -> Optional[tuple]:
+        """Return (batch, jobs in submission order) or None"""
+        with db_connect() as conn:
+            batch = conn.execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+            if batch is None:
+                return None
+            jobs = conn.execute(
+                "SELECT * FROM jobs WHERE batch_id = ? ORDER BY created_at", (batch_id,)
+            ).fetchall()
+        return dict(batch), [dict(job) for job in jobs]
+
+    def update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        with db_connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def heartbeat(self, job_ids: list):
+        now = time.time()
+        with db_connect() as conn:
+            conn.executemany(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ? AND state = 'running'",
+                [(now, job_id) for job_id in job_ids],
+            )
+
+    def requeue(self, worker: str):
+        """Put jobs claimed by a stopping worker back in the queue"""
+        with db_connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'queued', stage = NULL, worker = NULL, updated_at = ?"
+                " WHERE state = 'running' AND worker = ?",
+                (time.time(), worker),
+            )
+
+    def maintain(self):
+        """Requeue jobs whose worker died and drop expired results"""
+        now = time.time()
+        with db_connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET state = 'failed', error = 'Worker lost too many times', finished_at = ?, updated_at = ?"
+                " WHERE state = 'running' AND heartbeat < ? AND attempts >= ?",
+                (now, now, now - JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS),
+            )
+            conn.execute(
+                "UPDATE jobs SET state = 'queued', stage = NULL, worker = NULL, updated_at = ?"
+                " WHERE state = 'running' AND heartbeat < ?",
+                (now, now - JOB_LEASE_SECONDS),
+            )
+            expired = conn.execute(
+                "SELECT id, file_path FROM jobs WHERE state IN ('finished', 'failed') AND finished_at < ?",
+                (now - JOB_RETENTION_SECONDS,),
+            ).fetchall()
+            for row in expired:
+                expire_job_result(row["file_path"])
+                conn.execute("DELETE FROM jobs WHERE id = ?", (row["id"],))
+            conn.execute(
+                "DELETE FROM batches WHERE created_at < ? AND id NOT IN"
+                " (SELECT batch_id FROM jobs WHERE batch_id IS NOT NULL)",
+                (now - JOB_RETENTION_SECONDS,),
+            )
+
+def expire_job_result(file_path: Optional[str]):
+    """Delete the result of an expired job (results served from the cache are owned by the cache)"""
+    if file_path and Path(file_path).parent == JOBS_DIR:
+        cleanup_file(Path(file_path))
+        if artifact_store is not None:
+            try:
+                artifact_store.delete(Path(file_path).stem)
+            except Exception:
+                ARTIFACT_STORE_ERRORS.labels("delete").inc()
+
+class DirectoryJobQueue:
+    """Download queue in a directory shared by all nodes, e.g. an NFS mount.
+
+    Each job is a JSON record in ``records/`` plus an empty marker file, named
+    ``{created_at_ns}_{job id}`` so that listing a directory gives the queue
+    order. The directory holding the marker is the job state: ``queued/``,
+    ``running/``, ``finished/`` or ``failed/``. State changes rename the
+    marker, which is atomic, so exactly one node wins a claim. The marker's
+    mtime is set on every state change and heartbeat, which makes it the
+    lease. Records are replaced atomically by the node that holds the job.
+    """
+
+    shared = True  # workers on every node take jobs
+    STATES = ('queued', 'running', 'finished', 'failed')
+
+    def __init__(self, root: Path):
+        self.root = root
+        for name in ('records', 'batches', *self.STATES):
+            (root / name).mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()  # read-modify-write of records in this process
+        self.markers = {}  # job id -> marker name
+        self.claims = {}  # marker name -> (client, cost, batch id), fixed at submission
+        self.concurrency = {}  # batch id -> concurrency, fixed at submission
+
+    def _read(self, path: Path) -> Optional[dict]:
+        try:
+            return json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path: Path, record: dict):
+        tmp = path.parent / f".{uuid.uuid4().hex}.tmp"
+        tmp.write_text(json.dumps(record))
+        os.replace(tmp, path)
+
+    def _move(self, marker: str, state: str, source: Optional[str] = None) -> bool:
+        """Move a marker to a state directory, from source or wherever it is; False if another node was first"""
+        for old in (source,) if source else self.STATES:
+            try:
+                os.rename(self.root / old / marker, self.root / state / marker)
+            except FileNotFoundError:
+                continue
+            os.utime(self.root / state / marker)
+            return True
+        return False
+
+    def submit(self, url: str, format_type: str, client: Optional[str] = None, cost: float = 1,
+               clip: Optional[dict] = None) -> str:
+        """Queue a new job and return its id"""
+        return self.submit_many([url], format_type, client=client, cost=cost, clip=clip)[0]
+
+    def submit_many(self, urls: list, format_type: str, batch_id: Optional[str] = None,
+                    concurrency: int = 0, client: Optional[str] = None, cost: float = 1,
+                    clip: Optional[dict] = None) -> list:
+        """Queue jobs (optionally as one batch) and return their ids"""
+        # Nodes may race past the limits by a few jobs, which is fine for soft limits
+        queued = os.listdir(self.root / 'queued')
+        if len(queued) + len(urls) > JOB_QUEUE_LIMIT:
+            raise Overloaded("Job queue is full, try again later")
+        if client is not None:
+            mine = sum(1 for marker in queued if (self._claim_info(marker) or (None,))[0] == client)
+            if mine + len(urls) > JOB_CLIENT_QUEUE_LIMIT:
+                raise Overloaded("Too many queued jobs, wait for some to start", status_code=429)
+        job_ids = [uuid.uuid4().hex for _ in urls]
+        now = time.time()
+        if batch_id:
+            self._write(self.root / 'batches' / f"{batch_id}.json", {
+                "id": batch_id, "format": format_type, "concurrency": concurrency,
+                "created_at": now, "jobs": job_ids,
+            })
+        records = []
+        for i, (job_id, url) in enumerate(zip(job_ids, urls)):
+            # Spread created_at slightly so batch items keep their order
+            created_at = now + i * 1e-6
+            record = {
+                "id": job_id, "url": url, "format": format_type, "state": 'queued', "stage": None,
+                "progress": 0, "downloaded_bytes": None, "total_bytes": None, "speed": None, "eta": None,
+                "title": None, "file_path": None, "error": None, "attempts": 0, "worker": None,
+                "heartbeat": None, "created_at": created_at, "updated_at": now, "finished_at": None,
+                "batch_id": batch_id, "client": client, "cost": cost,
+                "fragment_index": None, "fragment_count": None, "clip": clip and json.dumps(clip),
+                "marker": f"{int(created_at * 1e9):020d}_{job_id}",
+            }
+            self._write(self.root / 'records' / f"{job_id}.json", record)
+            records.append(record)
+        # Markers last, so a claimed job always has its record
+        for record in records:
+            (self.root / 'queued' / record['marker']).touch()
+        return job_ids
+
+    def get(self, job_id: str) -> Optional[dict]:
+        if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+            return None
+        return self._read(self.root / 'records' / f"{job_id}.json")
+
+    def ids(self) -> set:
+        return {name[:-5] for name in os.listdir(self.root / 'records') if name.endswith(".json")}
+
+    def counts(self) -> dict:
+        """Number of jobs by state"""
+        return {state: len(os.listdir(self.root / state)) for state in self.STATES}
+
+    def _claim_info(self, marker: str) -> Optional[tuple]:
+        info = self.claims.get(marker)
+        if info is None:
+            record = self.get(marker.split("_")[1])
+            if record is None:
+                return None
+            info = self.claims[marker] = (record['client'], record['cost'], record['batch_id'])
+        return info
+
+    def _batch_concurrency(self, batch_id: str) -> int:
+        if batch_id not in self.concurrency:
+            batch = self._read(self.root / 'batches' / f"{batch_id}.json")
+            self.concurrency[batch_id] = batch['concurrency'] if batch else 1
+        return self.concurrency[batch_id]
+
+    def claim(self, worker: str) -> Optional[dict]:
+        """Atomically take the next queued job, fairly between clients"""
+        queued = sorted(os.listdir(self.root / 'queued'))
+        if not queued:
+            return None
+        running = os.listdir(self.root / 'running')
+        # Forget markers that left the queue
+        self.claims = {marker: self.claims[marker] for marker in (*queued, *running) if marker in self.claims}
+        
+        # Batches may only run up to their own concurrency at a time, and the
+        # client with the least running cost goes first
+        client_cost, batch_running = {}, {}
+        for marker in running:
+            info = self._claim_info(marker)
+            if info:
+                client, cost, batch_id = info
+                client_cost[client] = client_cost.get(client, 0) + cost
+                batch_running[batch_id] = batch_running.get(batch_id, 0) + 1
+        candidates = [(marker, info) for marker in queued if (info := self._claim_info(marker))]
+        candidates.sort(key=lambda item: client_cost.get(item[1][0], 0))
+        for marker, (client, cost, batch_id) in candidates:
+            if batch_id and batch_running.get(batch_id, 0) >= self._batch_concurrency(batch_id):
+                continue
+            if not self._move(marker, 'running', 'queued'):
+                continue  # another node claimed it
+            record = self.get(marker.split("_")[1])
+            attempts = record['attempts'] + 1
+            self.update(record['id'], state='running', stage='starting', worker=worker,
+                        heartbeat=time.time(), attempts=attempts)
+            record.update(state='running', attempts=attempts)
+            return record
+        return None
+
+    def list_batch(self, batch_id: str) -> Optional[tuple]:
+        """Return (batch, jobs in submission order) or None"""
+        if not re.fullmatch(r'[0-9a-f]{32}', batch_id):
+            return None
+        batch = self._read(self.root / 'batches' / f"{batch_id}.json")
+        if batch is None:
+            return None
+        jobs = [job for job_id in batch['jobs'] if (job := self.get(job_id))]
+        return batch, jobs
+
+    def update(self, job_id: str, **fields):
+        with self.lock:
+            record = self.get(job_id)
+            if record is None:
+                return
+            # The claim has already moved the marker to running
+            if fields.get('state', 'running') != 'running':
+                self._move(record['marker'], fields['state'])
+            record.update(fields, updated_at=time.time())
+            self._write(self.root / 'records' / f"{job_id}.json", record)
+            self.markers[job_id] = record['marker']
+
+    def heartbeat(self, job_ids: list):
+        for job_id in job_ids:
+            try:
+                os.utime(self.root / 'running' / self.markers[job_id])
+            except (KeyError, OSError):
+                continue
+
+    def _release(self, record: dict, **fields):
+        """Take a running job back if its marker is still where it was, for requeueing or failing it"""
+        if self._move(record['marker'], fields['state'], 'running'):
+            with self.lock:
+                record.update(fields, updated_at=time.time())
+                self._write(self.root / 'records' / f"{record['id']}.json", record)
+
+    def requeue(self, worker: str):
+        """Put jobs claimed by a stopping worker back in the queue"""
+        for marker in os.listdir(self.root / 'running'):
+            record = self.get(marker.split("_")[1])
+            if record and record['worker'] == worker:
+                self._release(record, state='queued', stage=None, worker=None)
+
+    def maintain(self):
+        """Requeue jobs whose worker died and drop expired results"""
+        now = time.time()
+        for entry in os.scandir(self.root / 'running'):
+            try:
+                if entry.stat().st_mtime >= now - JOB_LEASE_SECONDS:
+                    continue
+            except OSError:
+                continue
+            record = self.get(entry.name.split("_")[1])
+            if record is None:
+                cleanup_file(Path(entry.path))
+            elif record['attempts'] >= JOB_MAX_ATTEMPTS:
+                self._release(record, state='failed', stage=None, error='Worker lost too many times', finished_at=now)
+            else:
+                self._release(record, state='queued', stage=None, worker=None)
+        
+        for state in ('finished', 'failed'):
+            for entry in os.scandir(self.root / state):
+                try:
+                    if entry.stat().st_mtime >= now - JOB_RETENTION_SECONDS:
+                        continue
+                except OSError:
+                    continue
+                job_id = entry.name.split("_")[1]
+                record = self.get(job_id)
+                if record:
+                    expire_job_result(record['file_path'])
+                cleanup_file(self.root / 'records' / f"{job_id}.json")
+                cleanup_file(Path(entry.path))
+                self.markers.pop(job_id, None)
+        
+        for entry in os.scandir(self.root / 'batches'):
+            batch = self._read(Path(entry.path))
+            if batch and batch['created_at'] < now - JOB_RETENTION_SECONDS and not any(
+                (self.root / 'records' / f"{job_id}.json").exists() for job_id in batch['jobs']
+            ):
+                cleanup_file(Path(entry.path))
+                self.concurrency.pop(batch['id'], None)
+
+class JobProgress:
+    """yt-dlp hooks that record job progress, throttled to one write per PROGRESS_INTERVAL"""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.last_write = 0.0
+
+    def on_download(self, d: dict):
+        now = time.time()
+        if d['status'] == 'downloading' and now - self.last_write < PROGRESS_INTERVAL:
+            return
+        self.last_write = now
+        downloaded = d.get('downloaded_bytes')
+        total = d.get('total_bytes') or d.get('total_bytes_estimate')
+        job_queue.update(
+            self.job_id,
+            stage='downloading',
+            progress=round(100 * downloaded / total, 1) if downloaded and total else 0,
+            downloaded_bytes=downloaded,
+            total_bytes=total,
+            speed=d.get('speed'),
+            eta=d.get('eta'),
+            fragment_index=d.get('fragment_index'),
+            fragment_count=d.get('fragment_count'),
+        )
+
+    def on_postprocess(self, d: dict):
+        if d['status'] == 'started':
+            job_queue.update(self.job_id, stage=f"postprocessing ({d.get('postprocessor')})")
+
+class JobWorkerPool:
+    """Threads that take jobs from the queue and run the downloads"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.current = {}  # job id -> cost
+        self.threads = []
+
+    def start(self):
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopping.clear()
+        self.threads = [
+            threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            for i in range(self.size)
+        ]
+        self.threads.append(threading.Thread(target=self._maintain, name="job-janitor", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.wakeup.set()
+        job_queue.requeue(self.worker)
+
+    @property
+    def load(self) -> float:
+        return sum(self.current.values())
+
+    def _run(self):
+        while not self.stopping.is_set():
+            # With a shared queue, busy nodes hold back so idle ones claim first
+            if job_queue.shared and self.load and self.stopping.wait(min(1.0, JOB_CLAIM_BACKOFF * self.load)):
+                break
+            # Jobs stay queued while the origin is throttling us; once the
+            # cooldown is over a claimed job makes the half-open probe
+            if breaker.blocked():
+                if self.stopping.wait(timeout=1):
+                    break
+                continue
+            try:
+                job = job_queue.claim(self.worker)
+            except (sqlite3.Error, OSError):
+                job = None
+            if job is None:
+                # Other workers may have queued jobs, so poll as well
+                self.wakeup.wait(timeout=1)
+                self.wakeup.clear()
+                continue
+            self._execute(job)
+
+    def _execute(self, job: dict):
+        job_id = job['id']
+        self.current[job_id] = job['cost']
+        with tracer.trace("job", job_id=job_id, url=job['url'], format=job['format'], attempt=job['attempts']) as job_span:
+            try:
+                clip = json.loads(job['clip']) if job.get('clip') else None
+                title, file_path, _ = _fetch_blocking(job['url'], job['format'], job_id=job_id, clip=clip)
+                job_queue.update(
+                    job_id, state='finished', stage=None, progress=100, title=title,
+                    file_path=file_path, finished_at=time.time(),
+                )
+            except Exception as e:
+                job_span.fail(e)
+                if classify_error(e) in TRANSIENT_ERRORS and job['attempts'] < JOB_MAX_ATTEMPTS:
+                    job_queue.update(job_id, state='queued', stage=None, worker=None, error=str(e))
+                else:
+                    job_queue.update(job_id, state='failed', stage=None, error=str(e), finished_at=time.time())
+            finally:
+                self.current.pop(job_id, None)
+
+    def _maintain(self):
+        while not self.stopping.wait(timeout=JOB_LEASE_SECONDS / 4):
+            try:
+                if self.current:
+                    job_queue.heartbeat(list(self.current))
+                job_queue.maintain()
+            except (sqlite3.Error, OSError):
+                pass
+
+# Jobs run on whichever node claims them, so the others need the store to serve the result
+if JOB_BACKEND == "directory" and artifact_store is None:
+    raise ValueError("JOB_BACKEND=directory requires ARTIFACT_STORE, so that any node can serve a job's result")
+job_queue = DirectoryJobQueue(JOB_STATE_DIR) if JOB_BACKEND == "directory" else JobQueue()
+job_workers = JobWorkerPool(JOB_WORKERS)
+
+def job_status(job: dict) -> dict:
+    """Public view of a job record"""
+    status = {
+        "job_id": job['id'],
+        "url": job['url'],
+        "format": job['format'],
+        "clip": json.loads(job['clip']) if job.get('clip') else None,
+        "state": job['state'],
+        "stage": job['stage'],
+        "progress": job['progress'],
+        "downloaded_bytes": job['downloaded_bytes'],
+        "total_bytes": job['total_bytes'],
+        "speed": job['speed'],
+        "eta": job['eta'],
+        "fragment_index": job['fragment_index'],
+        "fragment_count": job['fragment_count'],
+        "title": job['title'],
+        "error": job['error'],
+        "created_at": job['created_at'],
+        "updated_at": job['updated_at'],
+        "status_url": f"/jobs/{job['id']}",
+        "events_url": f"/jobs/{job['id']}/events",
+    }
+    if job['state'] == 'finished':
+        status["file_url"] = f"/jobs/{job['id']}/file"
+    return status
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: DownloadRequest, http_request: Request):
+    """Queue a download and return immediately with a job id"""
+    clip = clip_spec(request)
+    cost = format_cost(request.format)
+    client = await admit(http_request, "jobs", cost)
+    try:
+        job_id = await asyncio.to_thread(job_queue.submit, request.url, request.format, client, cost, clip)
+    except Overloaded:
+        await refund(client, cost)
+        raise
+    job_workers.wakeup.set()
+    return job_status(await asyncio.to_thread(job_queue.get, job_id))
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    """Get the state and progress of a download job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_status(job)
+
+async def job_events(job_id: str):
+    """Server-Sent Events with the job status whenever it changes, until it is done"""
+    yield f"retry: {int(PROGRESS_INTERVAL * 4000)}\n\n"
+    last_update = None
+    last_sent = time.monotonic()
+    while True:
+        job = await asyncio.to_thread(job_queue.get, job_id)
+        if job is None:
+            yield f"event: error\ndata: {json.dumps({'detail': 'Job not found'})}\n\n"
+            return
+        done = job['state'] in ('finished', 'failed')
+        if job['updated_at'] != last_update:
+            last_update = job['updated_at']
+            last_sent = time.monotonic()
+            yield f"event: {'done' if done else 'progress'}\ndata: {json.dumps(job_status(job))}\n\n"
+        elif time.monotonic() - last_sent > PROGRESS_KEEPALIVE:
+            last_sent = time.monotonic()
+            yield ": keep-alive\n\n"
+        if done:
+            return
+        await asyncio.sleep(PROGRESS_INTERVAL)
+
+@app.get("/jobs/{job_id}/events")
+def get_job_events(job_id: str):
+    """Stream the progress of a download job as Server-Sent Events"""
+    if job_queue.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        job_events(job_id),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+@app.get("/jobs/{job_id}/file")
+def get_job_file(job_id: str):
+    """Download the result of a finished job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job['state'] != 'finished':
+        return JSONResponse(status_code=409, content=job_status(job))
+    file_path = local_result(Path(job['file_path']))
+    if file_path is None:
+        raise HTTPException(status_code=410, detail="Job result has expired")
+    return ArtifactResponse(
+        file_path, safe_filename(job['title'] or 'video', file_path.suffix),
+        content_location=f"/jobs/{job_id}/file", format_key=normalize_format(job['format']),
+    )
+
+def _enumerate_playlist_blocking(url: str) -> list:
+    """List the video URLs of a playlist without extracting each video"""
+    ydl_opts = base_ydl_opts()
+    ydl_opts['extract_flat'] = 'in_playlist'
+    ydl_opts['playlistend'] = BATCH_MAX_ITEMS
+    
+    def extract() -> dict:
+        with ydl_pool.get(ydl_opts) as ydl:
+            return ydl.extract_info(url, download=False)
+    info = call_origin(extract)
+    
+    if info.get('_type') != 'playlist':
+        return [url]
+    return [entry.get('url') or entry.get('webpage_url') for entry in info.get('entries') or [] if entry]
+
+def batch_status(batch: dict, jobs: list) -> dict:
+    """Public view of a batch and its items"""
+    counts = {state: 0 for state in ('queued', 'running', 'finished', 'failed')}
+    for job in jobs:
+        counts[job['state']] += 1
+    return {
+        "batch_id": batch['id'],
+        "format": batch['format'],
+        "concurrency": batch['concurrency'],
+        "total": len(jobs),
+        "counts": counts,
+        "progress": round(sum(job['progress'] for job in jobs) / len(jobs), 1) if jobs else 100,
+        "done": counts['queued'] + counts['running'] == 0,
+        "status_url": f"/batches/{batch['id']}",
+        "zip_url": f"/batches/{batch['id']}/zip",
+        "items": [job_status(job) for job in jobs],
+    }
+
+class ZipStream:
+    """Write-only file object that collects zipfile output for streaming"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def zip_batch(batch_id: str):
+    """Yield a zip of the batch results, adding each item as soon as it finishes"""
+    stream = ZipStream()
+    added = set()
+    failures = []
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        while True:
+            listing = job_queue.list_batch(batch_id)
+            if listing is None:
+                break
+            pending = False
+            for index, job in enumerate(listing[1], 1):
+                if job['id'] in added:
+                    continue
+                if job['state'] in ('queued', 'running'):
+                    pending = True
+                    continue
+                added.add(job['id'])
+                file_path = local_result(Path(job['file_path'])) if job['file_path'] else None
+                if job['state'] != 'finished' or file_path is None:
+                    failures.append(f"{job['url']}: {job['error'] or 'result expired'}")
+                    continue
+                
+                name = f"{index:03d} - {safe_filename(job['title'] or 'video', file_path.suffix)}"
+                with open(file_path, 'rb') as src, archive.open(name, 'w', force_zip64=True) as dst:
+                    while chunk := src.read(STREAM_CHUNK_SIZE):
+                        dst.write(chunk)
+                        yield stream.drain()
+                yield stream.drain()
+            if not pending:
+                break
+            time.sleep(1)
+        
+        # Failed items are listed instead of aborting the whole archive
+        if failures:
+            archive.writestr("errors.txt", "\n".join(failures) + "\n")
+    yield stream.drain()
+
+@app.post("/batches", status_code=202)
+async def create_batch(request: BatchRequest, http_request: Request):
+    """Queue a list of URLs and/or a playlist as one batch of download jobs"""
+    if len(request.urls) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch can have at most {BATCH_MAX_ITEMS} items")
+    # Every item is charged in full. The listed URLs are admitted before the
+    # playlist is enumerated, its entries are charged once they are known
+    cost = format_cost(request.format)
+    charged = cost * max(len(request.urls), 1)
+    client = await admit(http_request, "batches", charged)
+    try:
+        urls = list(request.urls)
+        if request.playlist_url:
+            urls += await extract_executor.run(_enumerate_playlist_blocking, request.playlist_url)
+            if rate_limiter.enabled and cost * len(urls) > charged:
+                await asyncio.to_thread(rate_limiter.credit, client, charged - cost * len(urls))
+                charged = cost * len(urls)
+    except Overloaded:
+        await refund(client, charged)
+        raise
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise origin_error(e)
+    
+    if not urls:
+        raise HTTPException(status_code=400, detail="No URLs to download")
+    if len(urls) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A batch can have at most {BATCH_MAX_ITEMS} items")
+    
+    batch_id = uuid.uuid4().hex
+    concurrency = max(1, min(request.concurrency, BATCH_MAX_CONCURRENCY))
+    try:
+        await asyncio.to_thread(job_queue.submit_many, urls, request.format, batch_id, concurrency, client, cost)
+    except Overloaded:
+        await refund(client, charged)
+        raise
+    job_workers.wakeup.set()
+    return batch_status(*await asyncio.to_thread(job_queue.list_batch, batch_id))
+
+@app.get("/batches/{batch_id}")
+def get_batch(batch_id: str):
+    """Get the progress of a batch and each of its items"""
+    listing = job_queue.list_batch(batch_id)
+    if listing is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return batch_status(*listing)
+
+@app.get("/batches/{batch_id}/zip")
+def get_batch_zip(batch_id: str):
+    """Stream a zip of the batch results, waiting for items that are still running"""
+    if job_queue.list_batch(batch_id) is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return StreamingResponse(
+        (chunk for chunk in zip_batch(batch_id) if chunk),
+        media_type='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="batch-{batch_id}.zip"'},
+    )
+
 @app.post("/upload-cookies")
-async def upload_cookies(cookies: UploadFile = File(...)):
-    """Upload YouTube cookies to bypass bot detection"""
+async def upload_cookies(cookies: UploadFile = File(...), name: str = "default"):
+    """Upload YouTube cookies to bypass bot detection (one jar per account name)"""
     try:
         content = await cookies.read()
-        COOKIES_FILE.write_bytes(content)
-        return {"message": "Cookies uploaded successfully", "status": "success"}
+        jar = await asyncio.to_thread(cookie_jars.publish, name, content)
+        info_cache.clear_errors()
+        ydl_pool.invalidate()
+        return {"message": "Cookies uploaded successfully", "status": "success", "jar": jar,
+                "version": cookie_jars.version}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @app.delete("/cookies")
-async def delete_cookies():
-    """Delete uploaded cookies"""
+async def delete_cookies(name: Optional[str] = None):
+    """Delete one cookie jar, or all of them"""
     try:
-        if COOKIES_FILE.exists():
-            COOKIES_FILE.unlink()
+        await asyncio.to_thread(cookie_jars.remove, name)
+        info_cache.clear_errors()
+        ydl_pool.invalidate()
         return {"message": "Cookies deleted successfully", "status": "success"}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -575,15 +4256,48 @@ async def delete_cookies():
 @app.get("/cookies/status")
 async def cookies_status():
     """Check if cookies are uploaded"""
-    return {
-        "has_cookies": COOKIES_FILE.exists(),
-        "file_size": COOKIES_FILE.stat().st_size if COOKIES_FILE.exists() else 0
-    }
+    status = cookie_jars.status()
+    return {"has_cookies": bool(status["jars"]), **status}
+
+class StateCollector:
+    """Metrics read at scrape time from state shared by all workers"""
+
+    def collect(self):
+        jobs = GaugeMetricFamily("ytdl_jobs", "Background jobs by state", labels=["state"])
+        counts = job_queue.counts()
+        for state in ('queued', 'running', 'finished', 'failed'):
+            jobs.add_metric([state], counts.get(state, 0))
+        yield jobs
+
+        disk = GaugeMetricFamily("ytdl_disk_usage_bytes", "Bytes used in DOWNLOAD_DIR by area", labels=["area"])
+        for area, path in (("downloads", DOWNLOAD_DIR), ("cache", CACHE_DIR), ("artifacts", ARTIFACTS_DIR), ("jobs", JOBS_DIR)):
+            disk.add_metric([area], directory_size(path))
+        yield disk
+
+        reserved = GaugeMetricFamily("ytdl_storage_reserved_bytes", "Bytes reserved by downloads in progress")
+        reserved.add_metric([], storage.reserved())
+        yield reserved
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus metrics, aggregated over all uvicorn workers"""
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(StateCollector())
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
 
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    return {"status": "healthy"}
+    origin = breaker.status()
+    return {
+        "status": "healthy" if origin["state"] == "closed" else "degraded",
+        "breaker": origin,
+        "pools": {
+            executor.name: {"running": executor.running, "waiting": executor.waiting, "workers": executor.max_workers}
+            for executor in (extract_executor, download_executor)
+        },
+    }
 
 if __name__ == "__main__":
     import uvicorn
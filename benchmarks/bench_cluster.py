@@ -0,0 +1,114 @@
+"""Compare independent nodes with nodes that share a job queue and artifact store.
+
+Starts the fixture origin, the fake S3 server and two app nodes, each with its
+own DOWNLOAD_DIR, then sends every /download to node A, as a sticky load
+balancer would. In "local" mode each node only runs its own downloads; in
+"shared" mode the nodes share a directory job queue and an S3 artifact store,
+so node B takes part of the work. Afterwards every result is fetched again
+from node B through its Content-Location.
+
+    python benchmarks/bench_cluster.py --videos 16 --concurrency 8 --rate 2000000
+"""
+import argparse
+import asyncio
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import fake_s3  # noqa: E402
+from fixture_server import Fixture, start_server  # noqa: E402
+from loadgen import free_port, start_app  # noqa: E402
+
+def downloads_done(base_url: str) -> int:
+    """Successful yt-dlp downloads of a node, from its metrics"""
+    text = httpx.get(f"{base_url}/metrics").text
+    return int(sum(float(line.rsplit(" ", 1)[1]) for line in text.splitlines()
+                   if re.match(r'ytdl_downloads_total\{.*result="ok"', line)))
+
+async def run(nodes: list, origin: str, args) -> dict:
+    node_a, node_b = nodes
+    locations = []
+
+    async with httpx.AsyncClient(timeout=300) as client:
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def download(i: int) -> bool:
+            async with semaphore:
+                response = await client.post(f"{node_a}/download", json={"url": f"{origin}/watch/c{i}", "format": "best"})
+                if response.status_code == 200:
+                    locations.append((response.headers.get("content-location"), response.content))
+                return response.status_code == 200
+
+        started = time.monotonic()
+        ok = sum(await asyncio.gather(*(download(i) for i in range(args.videos))))
+        elapsed = time.monotonic() - started
+
+        served_by_b = 0
+        for location, content in locations:
+            if location:
+                response = await client.get(f"{node_b}{location}")
+                served_by_b += response.status_code == 200 and response.content == content
+
+    return {
+        "ok": ok,
+        "seconds": round(elapsed, 2),
+        "downloads": [downloads_done(node) for node in nodes],
+        "served_by_b": served_by_b,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--videos", type=int, default=16, help="distinct videos, all requested from node A")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--segments", type=int, default=8)
+    parser.add_argument("--segment-size", type=int, default=256 * 1024)
+    parser.add_argument("--latency", type=float, default=0.02, help="origin seconds per request")
+    parser.add_argument("--rate", type=int, default=2_000_000, help="origin bytes/s per connection")
+    args = parser.parse_args()
+
+    origin = start_server(Fixture(args.segments, args.segment_size, args.latency, args.rate))
+    origin_url = f"http://127.0.0.1:{origin.server_port}"
+    s3 = fake_s3.start_server(fake_s3.ObjectStore())
+    workdir = tempfile.mkdtemp(prefix="ytdl-cluster-")
+    os.environ.update(AWS_ACCESS_KEY_ID="test", AWS_SECRET_ACCESS_KEY="test", AWS_DEFAULT_REGION="us-east-1")
+    shared_env = [
+        "JOB_BACKEND=directory",
+        f"JOB_STATE_DIR={workdir}/queue",
+        "ARTIFACT_STORE=s3://ytdl/results",
+        f"S3_ENDPOINT_URL=http://127.0.0.1:{s3.server_port}",
+    ]
+
+    print(f"{'mode':<8} {'ok':>4} {'seconds':>8} {'node A':>7} {'node B':>7} {'served by B':>12}")
+    try:
+        for mode, env in (("local", []), ("shared", shared_env)):
+            servers = []
+            try:
+                nodes = []
+                for name in ("a", "b"):
+                    node_dir = os.path.join(workdir, mode, name)
+                    port = free_port()
+                    servers.append(start_app(port, node_dir, SimpleNamespace(env=env, workers=1)))
+                    nodes.append(f"http://127.0.0.1:{port}")
+                result = asyncio.run(run(nodes, origin_url, args))
+            finally:
+                for server in servers:
+                    server.terminate()
+                    server.wait()
+            print(f"{mode:<8} {result['ok']:>4} {result['seconds']:>8} {result['downloads'][0]:>7} "
+                  f"{result['downloads'][1]:>7} {result['served_by_b']:>12}")
+    finally:
+        origin.shutdown()
+        s3.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Compare wall-clock download time of the download tuning profiles.
+
+Runs yt-dlp with each profile from app.DOWNLOAD_PROFILES against the local
+fixture server (HLS, DASH and a progressive file) and prints a table.
+
+    python benchmarks/bench_profiles.py --runs 3 --segments 40 --rate 2000000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# app.py creates its state under DOWNLOAD_DIR on import
+WORKDIR = tempfile.mkdtemp(prefix="ytdl-bench-")
+os.environ.setdefault("DOWNLOAD_DIR", WORKDIR)
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(WORKDIR, "metrics"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import yt_dlp  # noqa: E402
+
+import app  # noqa: E402
+from fixture_server import Fixture, start_server  # noqa: E402
+
+def download_once(url: str, profile: str, outdir: str) -> float:
+    ydl_opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+        'fixup': 'never',
+        'outtmpl': os.path.join(outdir, '%(id)s.%(ext)s'),
+    }
+    app.apply_download_profile(ydl_opts, profile)
+    started = time.monotonic()
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        ydl.download([url])
+    return time.monotonic() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--segments", type=int, default=40)
+    parser.add_argument("--segment-size", type=int, default=512 * 1024)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--rate", type=int, default=2_000_000, help="bytes/s per connection")
+    parser.add_argument("--profiles", nargs="*", default=list(app.DOWNLOAD_PROFILES))
+    args = parser.parse_args()
+
+    fixture = Fixture(args.segments, args.segment_size, args.latency, args.rate)
+    server = start_server(fixture)
+    base = f"http://127.0.0.1:{server.server_port}"
+    targets = {
+        "hls": f"{base}/hls/index.m3u8",
+        "dash": f"{base}/dash/manifest.mpd",
+        "progressive": f"{base}/file/video.mp4",
+    }
+
+    size_mb = fixture.file_size / 1024 / 1024
+    print(f"{size_mb:.1f} MiB per download, {args.rate / 1e6:.1f} MB/s per connection, "
+          f"{args.latency * 1000:.0f} ms latency, {args.runs} runs\n")
+    print(f"{'target':<12} {'profile':<12} {'median s':>9} {'min s':>7} {'MiB/s':>7}")
+    for target, url in targets.items():
+        for profile in args.profiles:
+            times = []
+            for _ in range(args.runs):
+                with tempfile.TemporaryDirectory(dir=WORKDIR) as outdir:
+                    times.append(download_once(url, profile, outdir))
+            median = statistics.median(times)
+            print(f"{target:<12} {profile:<12} {median:>9.2f} {min(times):>7.2f} {size_mb / median:>7.1f}")
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
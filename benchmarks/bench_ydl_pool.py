@@ -0,0 +1,70 @@
+"""Compare per-request extraction time with and without the YoutubeDL pool.
+
+Extracts a video from the local fixture server with the "fixture" plugin
+extractor, building a new YoutubeDL for every request ("fresh", as before)
+or checking one out of app.ydl_pool ("pooled"). The fixture adds a fixed
+cost to every new connection, standing in for the TCP and TLS handshakes
+that keep-alive saves against YouTube.
+
+    python benchmarks/bench_ydl_pool.py --requests 50 --handshake 0.1 --latency 0.02
+
+Connection reuse needs the Requests handler of yt-dlp (pip install "yt-dlp[default]").
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# app.py creates its state under DOWNLOAD_DIR on import
+WORKDIR = tempfile.mkdtemp(prefix="ytdl-bench-")
+os.environ.setdefault("DOWNLOAD_DIR", WORKDIR)
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(WORKDIR, "metrics"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))  # also makes yt_dlp_plugins importable
+
+import yt_dlp  # noqa: E402
+
+import app  # noqa: E402
+from fixture_server import Fixture, start_server  # noqa: E402
+
+def extract_fresh(url: str) -> float:
+    started = time.monotonic()
+    with yt_dlp.YoutubeDL(app.base_ydl_opts()) as ydl:
+        ydl.extract_info(url, download=False)
+    return time.monotonic() - started
+
+def extract_pooled(url: str) -> float:
+    started = time.monotonic()
+    with app.ydl_pool.get(app.base_ydl_opts()) as ydl:
+        ydl.extract_info(url, download=False)
+    return time.monotonic() - started
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--handshake", type=float, default=0.1, help="seconds added to every new connection")
+    parser.add_argument("--latency", type=float, default=0.02, help="seconds added to every request")
+    args = parser.parse_args()
+
+    server = start_server(Fixture(latency=args.latency, handshake=args.handshake))
+    base = f"http://127.0.0.1:{server.server_port}/watch"
+    handlers = ", ".join(yt_dlp.networking.common._REQUEST_HANDLERS)
+    print(f"{args.requests} extractions, {args.handshake * 1000:.0f} ms per new connection, "
+          f"{args.latency * 1000:.0f} ms per request, handlers: {handlers}\n")
+    print(f"{'mode':<8} {'median ms':>10} {'p95 ms':>8} {'mean ms':>8}")
+
+    # Warm both paths once so imports and plugin loading are not measured
+    extract_fresh(f"{base}/warmup")
+    extract_pooled(f"{base}/warmup")
+    for mode, extract in (("fresh", extract_fresh), ("pooled", extract_pooled)):
+        times = sorted(extract(f"{base}/v{i}") * 1000 for i in range(args.requests))
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        print(f"{mode:<8} {statistics.median(times):>10.1f} {p95:>8.1f} {statistics.mean(times):>8.1f}")
+
+    server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""In-memory S3-compatible server for trying ARTIFACT_STORE=s3:// offline.
+
+Implements the part of the S3 API the app uses, with path-style URLs and no
+signature checks: Put/Get/Head/DeleteObject (with x-amz-meta-* metadata and
+Range), multipart uploads, ListObjectsV2 and DeleteObjects. Buckets exist as
+soon as they are used.
+
+    python benchmarks/fake_s3.py --port 9000
+    ARTIFACT_STORE=s3://ytdl/results S3_ENDPOINT_URL=http://127.0.0.1:9000 \\
+        AWS_ACCESS_KEY_ID=test AWS_SECRET_ACCESS_KEY=test AWS_DEFAULT_REGION=us-east-1 \\
+        uvicorn app:app
+"""
+import argparse
+import hashlib
+import http.server
+import re
+import threading
+import time
+import uuid
+from email.utils import formatdate
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+class ObjectStore:
+    """Objects and unfinished multipart uploads of all buckets"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.objects = {}  # (bucket, key) -> (data, metadata, modified at)
+        self.uploads = {}  # upload id -> (bucket, key, metadata, {part number: data})
+
+def read_body(handler) -> bytes:
+    """Request body, decoding the aws-chunked encoding that newer SDKs send"""
+    body = handler.rfile.read(int(handler.headers.get("Content-Length", 0)))
+    if "aws-chunked" not in handler.headers.get("Content-Encoding", ""):
+        return body
+    data, offset = bytearray(), 0
+    while True:
+        line_end = body.index(b"\r\n", offset)
+        size = int(body[offset:line_end].split(b";")[0], 16)
+        if size == 0:
+            return bytes(data)  # trailing checksums are ignored
+        data += body[line_end + 2:line_end + 2 + size]
+        offset = line_end + 2 + size + 2
+
+def make_handler(store: ObjectStore):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def parse(self) -> tuple:
+            url = urlsplit(self.path)
+            bucket, _, key = url.path.lstrip("/").partition("/")
+            return bucket, unquote(key), {name: values[0] for name, values in parse_qs(url.query, keep_blank_values=True).items()}
+
+        def send(self, status: int, body: bytes = b"", headers: dict = None, head: bool = False):
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            if not head:
+                self.wfile.write(body)
+
+        def send_xml(self, xml: str, status: int = 200):
+            self.send(status, f'<?xml version="1.0" encoding="UTF-8"?>{xml}'.encode(), {"Content-Type": "application/xml"})
+
+        def not_found(self, head: bool = False):
+            self.send(404, b"" if head else b"<Error><Code>NoSuchKey</Code></Error>", head=head)
+
+        def do_PUT(self):
+            bucket, key, query = self.parse()
+            data = read_body(self)
+            etag = f'"{hashlib.md5(data).hexdigest()}"'
+            with store.lock:
+                if "uploadId" in query:
+                    upload = store.uploads.get(query["uploadId"])
+                    if upload is None:
+                        return self.not_found()
+                    upload[3][int(query["partNumber"])] = data
+                else:
+                    store.objects[(bucket, key)] = (data, self.metadata(), time.time())
+            self.send(200, headers={"ETag": etag})
+
+        def metadata(self) -> dict:
+            return {name: value for name, value in self.headers.items() if name.lower().startswith("x-amz-meta-")}
+
+        def do_HEAD(self):
+            self.do_GET(head=True)
+
+        def do_GET(self, head: bool = False):
+            bucket, key, query = self.parse()
+            if not key:
+                return self.list_objects(bucket, query.get("prefix", ""))
+            with store.lock:
+                item = store.objects.get((bucket, key))
+            if item is None:
+                return self.not_found(head)
+            data, metadata, modified = item
+            headers = {
+                **metadata,
+                "ETag": f'"{hashlib.md5(data).hexdigest()}"',
+                "Last-Modified": formatdate(modified, usegmt=True),
+                "Accept-Ranges": "bytes",
+                "Content-Type": "application/octet-stream",
+            }
+            match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+            if match:
+                start = int(match.group(1) or 0)
+                end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+                headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+                return self.send(206, data[start:end + 1], headers, head)
+            self.send(200, data, headers, head)
+
+        def list_objects(self, bucket: str, prefix: str):
+            with store.lock:
+                items = sorted((key, item) for (name, key), item in store.objects.items()
+                               if name == bucket and key.startswith(prefix))
+            contents = "".join(
+                f"<Contents><Key>{escape(key)}</Key><Size>{len(data)}</Size>"
+                f"<LastModified>{time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(modified))}</LastModified>"
+                f'<ETag>"{hashlib.md5(data).hexdigest()}"</ETag></Contents>'
+                for key, (data, _, modified) in items
+            )
+            self.send_xml(
+                f"<ListBucketResult><Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>"
+                f"<KeyCount>{len(items)}</KeyCount><IsTruncated>false</IsTruncated>{contents}</ListBucketResult>"
+            )
+
+        def do_POST(self):
+            bucket, key, query = self.parse()
+            body = read_body(self)
+            if "delete" in query:
+                keys = [unquote(k) for k in re.findall(r"<Key>(.*?)</Key>", body.decode())]
+                with store.lock:
+                    for name in keys:
+                        store.objects.pop((bucket, name), None)
+                return self.send_xml("<DeleteResult></DeleteResult>")
+            if "uploads" in query:
+                upload_id = uuid.uuid4().hex
+                with store.lock:
+                    store.uploads[upload_id] = (bucket, key, self.metadata(), {})
+                return self.send_xml(
+                    f"<InitiateMultipartUploadResult><Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>"
+                    f"<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>"
+                )
+            if "uploadId" in query:
+                with store.lock:
+                    upload = store.uploads.pop(query["uploadId"], None)
+                    if upload is None:
+                        return self.not_found()
+                    _, _, metadata, parts = upload
+                    data = b"".join(parts[number] for number in sorted(parts))
+                    store.objects[(bucket, key)] = (data, metadata, time.time())
+                return self.send_xml(
+                    f"<CompleteMultipartUploadResult><Bucket>{escape(bucket)}</Bucket><Key>{escape(key)}</Key>"
+                    f'<ETag>"{hashlib.md5(data).hexdigest()}-{len(parts)}"</ETag></CompleteMultipartUploadResult>'
+                )
+            self.send(400)
+
+        def do_DELETE(self):
+            bucket, key, query = self.parse()
+            with store.lock:
+                if "uploadId" in query:
+                    store.uploads.pop(query["uploadId"], None)
+                else:
+                    store.objects.pop((bucket, key), None)
+            self.send(204)
+
+    return Handler
+
+def start_server(store: ObjectStore, port: int = 0) -> http.server.ThreadingHTTPServer:
+    """Start the fake S3 server in a background thread"""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), make_handler(store))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9000)
+    args = parser.parse_args()
+
+    server = start_server(ObjectStore(), args.port)
+    print(f"Serving fake S3 on http://127.0.0.1:{server.server_port}/ (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""Local HLS/DASH/progressive origin for offline benchmarks.
+
+Serves generated media-like payloads with a configurable per-request latency,
+per-connection setup cost and bandwidth limit, which is what makes concurrent
+fragment downloads and connection reuse pay off against a real CDN.
+
+    python benchmarks/fixture_server.py --port 8900 --segments 40 --rate 2000000
+
+URLs:
+    /hls/index.m3u8       HLS media playlist
+    /dash/manifest.mpd    DASH manifest with a SegmentTemplate
+    /file/video.mp4       progressive file (supports Range)
+    /file/video-only.mp4  video-only stream of the same size
+    /file/audio.m4a       audio-only stream, 1/8 of the size
+    /watch/<id>           video page for the "fixture" yt-dlp plugin extractor
+                          in benchmarks/yt_dlp_plugins (plus /player.js and
+                          /api/<id>.json, which lists the streams above)
+"""
+import argparse
+import hashlib
+import http.server
+import json
+import re
+import threading
+import time
+
+class Fixture:
+    """Deterministic fixture content and network shaping settings"""
+
+    def __init__(self, segments: int = 40, segment_size: int = 512 * 1024,
+                 latency: float = 0.05, rate: int = 2_000_000, handshake: float = 0.0):
+        self.segments = segments
+        self.segment_size = segment_size
+        self.latency = latency
+        self.rate = rate
+        self.handshake = handshake
+        self._block = hashlib.sha256(b"fixture").digest() * (64 * 1024 // 32)
+
+    @property
+    def file_size(self) -> int:
+        return self.segments * self.segment_size
+
+    def payload(self, size: int) -> bytes:
+        data = self._block * (size // len(self._block) + 1)
+        return data[:size]
+
+    def hls_playlist(self) -> str:
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:2", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for i in range(self.segments):
+            lines += ["#EXTINF:2.0,", f"seg{i}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    def watch_page(self, video_id: str) -> str:
+        return f'<html><title>{video_id}</title><div id="player" data-player="/player.js"></div></html>'
+
+    def video_metadata(self, video_id: str) -> str:
+        # Worst to best, like yt-dlp sorts them
+        return json.dumps({
+            "title": f"Fixture video {video_id}",
+            "duration": self.segments * 2,
+            "formats": [
+                {"format_id": "audio", "path": "/file/audio.m4a", "ext": "m4a", "vcodec": "none",
+                 "acodec": "mp4a.40.2", "filesize": self.file_size // 8},
+                {"format_id": "hls", "path": "/hls/index.m3u8", "protocol": "m3u8_native", "ext": "mp4",
+                 "vcodec": "avc1.4d401f", "acodec": "mp4a.40.2", "height": 480},
+                {"format_id": "video", "path": "/file/video-only.mp4", "ext": "mp4", "vcodec": "avc1.64001f",
+                 "acodec": "none", "height": 720, "filesize": self.file_size},
+                {"format_id": "progressive", "path": "/file/video.mp4", "ext": "mp4", "vcodec": "avc1.64001f",
+                 "acodec": "mp4a.40.2", "height": 720, "filesize": self.file_size},
+            ],
+        })
+
+    def dash_manifest(self) -> str:
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" minBufferTime="PT2S"
+     mediaPresentationDuration="PT{self.segments * 2}S" profiles="urn:mpeg:dash:profile:isoff-live:2011">
+  <Period id="0" start="PT0S">
+    <AdaptationSet mimeType="video/mp4" contentType="video" segmentAlignment="true">
+      <Representation id="video" bandwidth="{self.segment_size * 4}" codecs="avc1.64001f" width="1280" height="720">
+        <SegmentTemplate timescale="1000" duration="2000" startNumber="1"
+                         initialization="init.mp4" media="seg$Number$.m4s"/>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+def make_handler(fixture: Fixture):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def setup(self):
+            super().setup()
+            time.sleep(fixture.handshake)  # stands in for TCP and TLS setup
+        def do_HEAD(self):
+            self.do_GET(head=True)
+
+        def do_GET(self, head: bool = False):
+            time.sleep(fixture.latency)
+            path = self.path.split("?")[0]
+            if path == "/hls/index.m3u8":
+                return self.send_body(fixture.hls_playlist().encode(), "application/vnd.apple.mpegurl", head)
+            if path == "/dash/manifest.mpd":
+                return self.send_body(fixture.dash_manifest().encode(), "application/dash+xml", head)
+            if path == "/dash/init.mp4":
+                return self.send_body(fixture.payload(1024), "video/mp4", head)
+            if re.fullmatch(r"/hls/seg\d+\.ts|/dash/seg\d+\.m4s", path):
+                return self.send_body(fixture.payload(fixture.segment_size), "application/octet-stream", head)
+            if path in ("/file/video.mp4", "/file/video-only.mp4"):
+                return self.send_range(fixture.file_size, "video/mp4", head)
+            if path == "/file/audio.m4a":
+                return self.send_range(fixture.file_size // 8, "audio/mp4", head)
+            if match := re.fullmatch(r"/watch/([\w-]+)", path):
+                return self.send_body(fixture.watch_page(match.group(1)).encode(), "text/html", head)
+            if match := re.fullmatch(r"/api/([\w-]+)\.json", path):
+                return self.send_body(fixture.video_metadata(match.group(1)).encode(), "application/json", head)
+            if path == "/player.js":
+                return self.send_body(fixture.payload(256 * 1024), "text/javascript", head)
+            self.send_error(404)
+
+        def send_body(self, body: bytes, content_type: str, head: bool, status: int = 200, extra: dict = None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Accept-Ranges", "bytes")
+            for name, value in (extra or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            if not head:
+                self.write_throttled(body)
+
+        def send_range(self, size: int, content_type: str, head: bool):
+            match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+            if not match:
+                return self.send_body(fixture.payload(size), content_type, head)
+            start = int(match.group(1) or 0)
+            end = min(int(match.group(2)) if match.group(2) else size - 1, size - 1)
+            self.send_body(fixture.payload(end - start + 1), content_type, head, status=206,
+                           extra={"Content-Range": f"bytes {start}-{end}/{size}"})
+
+        def write_throttled(self, body: bytes):
+            chunk = 16 * 1024
+            for offset in range(0, len(body), chunk):
+                started = time.monotonic()
+                try:
+                    self.wfile.write(body[offset:offset + chunk])
+                except (BrokenPipeError, ConnectionResetError):
+                    # Extractors probe a URL and hang up early
+                    self.close_connection = True
+                    return
+                if fixture.rate:
+                    delay = chunk / fixture.rate - (time.monotonic() - started)
+                    if delay > 0:
+                        time.sleep(delay)
+
+    return Handler
+
+def start_server(fixture: Fixture, port: int = 0) -> http.server.ThreadingHTTPServer:
+    """Start the fixture server in a background thread"""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), make_handler(fixture))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--segments", type=int, default=40)
+    parser.add_argument("--segment-size", type=int, default=512 * 1024)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every request")
+    parser.add_argument("--rate", type=int, default=2_000_000, help="bytes/s per connection (0 = unlimited)")
+    parser.add_argument("--handshake", type=float, default=0.0, help="seconds added to every new connection")
+    args = parser.parse_args()
+
+    fixture = Fixture(args.segments, args.segment_size, args.latency, args.rate, args.handshake)
+    server = start_server(fixture, args.port)
+    print(f"Serving fixtures on http://127.0.0.1:{server.server_port}/ (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""Offline load test of the API against the local fixture origin.
+
+Starts the fixture origin and the app (under uvicorn, with its state in a
+temporary DOWNLOAD_DIR and the "fixture" plugin extractor on its path), then
+sends /info, /download or mixed requests for fixture videos at a fixed
+concurrency. Reports latency percentiles, throughput, peak RSS and disk I/O
+of the server processes, and can store the results as a baseline or compare
+against one, exiting with status 1 on a regression.
+
+    python benchmarks/loadgen.py --scenarios info download mixed --requests 200 --concurrency 8
+    python benchmarks/loadgen.py --save-baseline benchmarks/baseline.json
+    python benchmarks/loadgen.py --compare benchmarks/baseline.json --tolerance 0.25
+
+Downloads use --format best by default, which needs no ffmpeg; formats that
+are merged or converted (720p, mp3, ...) need ffmpeg installed. Requires httpx.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fixture_server import Fixture, start_server  # noqa: E402
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+
+# Share of each request type per scenario
+SCENARIOS = {
+    "info": {"info": 1.0},
+    "download": {"download": 1.0},
+    "mixed": {"info": 0.7, "download": 0.3},
+}
+
+# Metrics compared against the baseline: name -> True if higher is better
+COMPARED = {"p50_ms": False, "p95_ms": False, "p99_ms": False, "throughput_rps": True}
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def process_tree(pid: int) -> list:
+    """pid and all of its descendants"""
+    pids = [pid]
+    for parent in pids:
+        for task in Path(f"/proc/{parent}/task").glob("*"):
+            try:
+                pids += [int(child) for child in (task / "children").read_text().split()]
+            except OSError:
+                continue
+    return pids
+
+def read_proc(pid: int) -> tuple:
+    """(RSS bytes, disk read bytes, disk write bytes) of a process, zeros if it is gone"""
+    try:
+        status = Path(f"/proc/{pid}/status").read_text()
+        rss = next(int(line.split()[1]) * 1024 for line in status.splitlines() if line.startswith("VmRSS:"))
+        io = dict(line.split(": ") for line in Path(f"/proc/{pid}/io").read_text().splitlines())
+        return rss, int(io["read_bytes"]), int(io["write_bytes"])
+    except (OSError, StopIteration, KeyError, ValueError):
+        return 0, 0, 0
+
+class ProcessMonitor:
+    """Samples the RSS and disk I/O of the server process tree in a thread"""
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.io = {}  # pid -> (read bytes, write bytes), last seen
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        total_rss = 0
+        for pid in process_tree(self.pid):
+            rss, read, write = read_proc(pid)
+            total_rss += rss
+            if rss:
+                self.io[pid] = (read, write)
+        self.peak_rss = max(self.peak_rss, total_rss)
+
+    def disk_io(self) -> tuple:
+        return sum(r for r, _ in self.io.values()), sum(w for _, w in self.io.values())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self.start_io = self.disk_io()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+def percentile(values: list, q: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+async def run_scenario(client: httpx.AsyncClient, origin: str, mix: dict, args) -> dict:
+    rng = random.Random(args.seed)
+    kinds = rng.choices(list(mix), weights=list(mix.values()), k=args.requests)
+    # A small pool of videos, so some requests are cache hits, like real traffic
+    videos = [f"{origin}/watch/v{rng.randrange(args.videos)}" for _ in kinds]
+    latencies, errors, received = [], 0, 0
+    queue = asyncio.Queue()
+    for item in zip(kinds, videos):
+        queue.put_nowait(item)
+
+    async def worker():
+        nonlocal errors, received
+        while not queue.empty():
+            kind, url = queue.get_nowait()
+            started = time.monotonic()
+            try:
+                if kind == "info":
+                    response = await client.get("/info", params={"url": url})
+                    received += len(response.content)
+                else:
+                    async with client.stream("POST", "/download", json={"url": url, "format": args.format}) as response:
+                        async for chunk in response.aiter_raw():
+                            received += len(chunk)
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            latencies.append((time.monotonic() - started) * 1000)
+            errors += not ok
+
+    started = time.monotonic()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "received_mb_per_s": round(received / elapsed / 1e6, 2),
+    }
+
+def start_app(port: int, workdir: str, args) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        DOWNLOAD_DIR=os.path.join(workdir, "downloads"),
+        PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, "metrics"),
+        PYTHONPATH=os.pathsep.join([str(BENCH_DIR), str(REPO_DIR)]),
+        RATE_LIMIT_BURST="0",  # one client sends everything
+    )
+    env.update(item.split("=", 1) for item in args.env)
+    command = [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(args.workers), "--log-level", "warning"]
+    server = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return server
+        except httpx.HTTPError:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.2)
+    server.kill()
+    raise SystemExit("The app did not start")
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Describe every metric that is worse than the baseline by more than the tolerance"""
+    regressions = []
+    for scenario, current in results.items():
+        base = baseline.get("results", {}).get(scenario)
+        if not base:
+            continue
+        if current["errors"] > base["errors"]:
+            regressions.append(f"{scenario}: errors {base['errors']} -> {current['errors']}")
+        for metric, higher_is_better in COMPARED.items():
+            old, new = base[metric], current[metric]
+            worse = new < old * (1 - tolerance) if higher_is_better else new > old * (1 + tolerance)
+            if worse:
+                regressions.append(f"{scenario}: {metric} {old} -> {new}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="*", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--videos", type=int, default=20, help="distinct fixture videos requested")
+    parser.add_argument("--format", default="best")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--segments", type=int, default=8)
+    parser.add_argument("--segment-size", type=int, default=256 * 1024)
+    parser.add_argument("--latency", type=float, default=0.02, help="origin seconds per request")
+    parser.add_argument("--handshake", type=float, default=0.05, help="origin seconds per new connection")
+    parser.add_argument("--rate", type=int, default=0, help="origin bytes/s per connection (0 = unlimited)")
+    parser.add_argument("--env", nargs="*", default=[], metavar="KEY=VALUE", help="extra app settings")
+    parser.add_argument("--save-baseline", metavar="FILE")
+    parser.add_argument("--compare", metavar="FILE")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression")
+    args = parser.parse_args()
+
+    fixture = Fixture(args.segments, args.segment_size, args.latency, args.rate, args.handshake)
+    origin = start_server(fixture)
+    origin_url = f"http://127.0.0.1:{origin.server_port}"
+    workdir = tempfile.mkdtemp(prefix="ytdl-load-")
+    port = free_port()
+    server = None
+
+    results = {}
+    try:
+        print(f"{'scenario':<10} {'reqs':>5} {'errs':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'req/s':>7} {'MB/s':>6} {'RSS MB':>7} {'rd MB':>6} {'wr MB':>6}")
+        for scenario in args.scenarios:
+            # Each scenario starts cold, from an empty downloads volume and caches
+            if server:
+                server.terminate()
+                server.wait()
+            shutil.rmtree(os.path.join(workdir, "downloads"), ignore_errors=True)
+            server = start_app(port, workdir, args)
+            with ProcessMonitor(server.pid) as monitor:
+                with httpx.Client(base_url=f"http://127.0.0.1:{port}") as warmup:
+                    warmup.get("/health")
+
+                async def run():
+                    limits = httpx.Limits(max_connections=args.concurrency)
+                    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=300, limits=limits) as client:
+                        return await run_scenario(client, origin_url, SCENARIOS[scenario], args)
+                result = asyncio.run(run())
+            read, write = monitor.disk_io()
+            result.update(
+                peak_rss_mb=round(monitor.peak_rss / 1e6, 1),
+                disk_read_mb=round((read - monitor.start_io[0]) / 1e6, 1),
+                disk_write_mb=round((write - monitor.start_io[1]) / 1e6, 1),
+            )
+            results[scenario] = result
+            print(f"{scenario:<10} {result['requests']:>5} {result['errors']:>5} {result['p50_ms']:>8} "
+                  f"{result['p95_ms']:>8} {result['p99_ms']:>8} {result['throughput_rps']:>7} "
+                  f"{result['received_mb_per_s']:>6} {result['peak_rss_mb']:>7} "
+                  f"{result['disk_read_mb']:>6} {result['disk_write_mb']:>6}")
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        origin.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    settings = {name: value for name, value in vars(args).items()
+                if name not in ("save_baseline", "compare", "tolerance", "scenarios")}
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps({"settings": settings, "results": results}, indent=2) + "\n")
+        print(f"\nBaseline saved to {args.save_baseline}")
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        if baseline.get("settings") != settings:
+            print("\nWarning: the baseline was recorded with different settings")
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"\nNo regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+
+if __name__ == "__main__":
+    main()
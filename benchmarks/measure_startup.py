@@ -0,0 +1,123 @@
+"""Measure startup time and memory of the API workers.
+
+For each YDL_EXTRACTORS setting, reports the time to import the app and to
+warm the extractors (compile URL patterns, import the YouTube extractor) in a
+fresh interpreter. Then starts the server with `uvicorn --workers N` and with
+serve.py (preload and fork), and reports the time until every worker has
+finished its startup, plus the memory of each worker once it has warmed up.
+RSS counts shared pages once per process, PSS splits them between the
+processes that share them; total PSS is the memory the whole server uses.
+
+    python benchmarks/measure_startup.py --workers 4 --extractors default "youtube.*"
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from loadgen import REPO_DIR, free_port, process_tree  # noqa: E402
+
+IMPORT_SCRIPT = """
+import time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.warm_extractors()
+print(imported - started, time.perf_counter() - imported)
+"""
+
+def memory(pid: int) -> tuple:
+    """(RSS, PSS) of a process in bytes, zeros if it is gone"""
+    try:
+        fields = dict(line.split(":", 1) for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines()[1:])
+        return int(fields["Rss"].split()[0]) * 1024, int(fields["Pss"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+def import_times(env: dict) -> tuple:
+    """Seconds to import the app and to warm the extractors, in a new interpreter"""
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=REPO_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return tuple(float(value) for value in output.split())
+
+def start(command: list, env: dict, workers: int, timeout: float = 60) -> tuple:
+    """Start the server and wait until every worker has started, returning (process, seconds)"""
+    started = time.monotonic()
+    server = subprocess.Popen(command, cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, text=True)
+    ready = threading.Event()
+
+    def watch():
+        count = 0
+        for line in server.stderr:
+            count += "Application startup complete" in line
+            if count == workers:
+                ready.set()
+    threading.Thread(target=watch, daemon=True).start()
+    if not ready.wait(timeout):
+        server.kill()
+        raise SystemExit(f"The server did not start: {' '.join(command)}")
+    return server, time.monotonic() - started
+
+def measure(mode: str, env: dict, args) -> dict:
+    port = free_port()
+    if mode == "uvicorn":
+        command = [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--workers", str(args.workers)]
+    else:
+        command = [sys.executable, "serve.py", "--port", str(port), "--workers", str(args.workers)]
+    server, ready = start(command, env, args.workers)
+    try:
+        httpx.get(f"http://127.0.0.1:{port}/health", timeout=10)
+        time.sleep(args.settle)  # the lifespan warms extractors and YoutubeDL in the background
+        workers = [int(pid) for task in Path(f"/proc/{server.pid}/task").glob("*")
+                   for pid in (task / "children").read_text().split()]
+        worker_memory = [memory(pid) for pid in workers]
+        total_pss = sum(memory(pid)[1] for pid in process_tree(server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "ready_s": round(ready, 2),
+        "worker_rss_mb": round(sum(rss for rss, _ in worker_memory) / len(worker_memory) / 1e6, 1),
+        "worker_pss_mb": round(sum(pss for _, pss in worker_memory) / len(worker_memory) / 1e6, 1),
+        "total_pss_mb": round(total_pss / 1e6, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--extractors", nargs="*", default=["default", "youtube.*"], help="YDL_EXTRACTORS settings")
+    parser.add_argument("--modes", nargs="*", default=["uvicorn", "serve"], choices=["uvicorn", "serve"])
+    parser.add_argument("--settle", type=float, default=3, help="seconds to let the workers warm up")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="ytdl-startup-")
+    print(f"{'extractors':<12} {'import s':>8} {'warm s':>7} {'mode':<8} {'ready s':>8} "
+          f"{'RSS/worker':>10} {'PSS/worker':>10} {'total PSS':>10}")
+    try:
+        for extractors in args.extractors:
+            env = dict(
+                os.environ,
+                DOWNLOAD_DIR=os.path.join(workdir, "downloads"),
+                PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, "metrics"),
+                YDL_EXTRACTORS=extractors,
+            )
+            imported, warmed = import_times(env)
+            for mode in args.modes:
+                result = measure(mode, env, args)
+                print(f"{extractors:<12} {imported:>8.2f} {warmed:>7.2f} {mode:<8} {result['ready_s']:>8} "
+                      f"{result['worker_rss_mb']:>10} {result['worker_pss_mb']:>10} {result['total_pss_mb']:>10}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
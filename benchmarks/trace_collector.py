@@ -0,0 +1,123 @@
+"""Stand-in for an OpenTelemetry collector, for looking at traces offline.
+
+Accepts OTLP/HTTP exports in JSON on /v1/traces, appends each request as a
+line to a file (the format of the collector's file exporter, which any OTLP
+tool can import) and prints where the time of every trace went: its root
+span, the time spent in each kind of child span, the bytes fetched and the
+slowest fragments.
+
+    python benchmarks/trace_collector.py --port 4318 --output traces.jsonl
+    TRACE_EXPORT=http://127.0.0.1:4318/v1/traces uvicorn app:app
+
+Traces that the app wrote to a file (TRACE_EXPORT=/path/traces.jsonl) can be
+summarized the same way:
+
+    python benchmarks/trace_collector.py --summarize traces.jsonl
+"""
+import argparse
+import collections
+import http.server
+import json
+import threading
+
+def attributes(span: dict) -> dict:
+    return {item["key"]: next(iter(item["value"].values())) for item in span.get("attributes", [])}
+
+def duration_ms(span: dict) -> float:
+    return (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+
+def summarize(request: dict) -> list:
+    """One line per trace in an OTLP export request, slowest parts first"""
+    traces = collections.defaultdict(list)
+    for resource_spans in request.get("resourceSpans", []):
+        for scope_spans in resource_spans.get("scopeSpans", []):
+            for span in scope_spans.get("spans", []):
+                traces[span["traceId"]].append(span)
+
+    lines = []
+    for trace_id, spans in traces.items():
+        ids = {span["spanId"] for span in spans}
+        roots = [span for span in spans if span.get("parentSpanId") not in ids]
+        root = max(roots, key=duration_ms)
+        root_attributes = attributes(root)
+        # Time by kind of span, fragments and the like summed up
+        by_name = collections.defaultdict(float)
+        for span in spans:
+            if span is not root:
+                by_name[span["name"]] += duration_ms(span)
+        parts = ", ".join(f"{name} {ms:.0f} ms" for name, ms in sorted(by_name.items(), key=lambda item: -item[1])[:6])
+        fetched = sum(int(attributes(span).get("bytes", 0)) for span in spans if span["name"] == "fetch")
+        fragments = sorted((span for span in spans if span["name"] == "fragment"), key=duration_ms, reverse=True)
+        status = root_attributes.get("http.response.status_code", "error" if root.get("status") else "ok")
+        line = f"{trace_id} {root['name']} [{status}] {duration_ms(root):.0f} ms: {parts or 'no child spans'}"
+        if fetched:
+            line += f"; fetched {fetched / 1e6:.1f} MB"
+        if fragments:
+            line += f"; {len(fragments)} fragments, slowest {', '.join(f'{duration_ms(f):.0f}' for f in fragments[:3])} ms"
+        if "profile" in root_attributes:
+            line += f"; profile {root_attributes['profile']}"
+        lines.append(line)
+    return lines
+
+def make_handler(output: str, lock: threading.Lock):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send(self, status: int, body: bytes = b"{}"):
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path != "/v1/traces" or "json" not in self.headers.get("Content-Type", ""):
+                return self.send(415 if self.path == "/v1/traces" else 404)
+            try:
+                request = json.loads(body)
+            except ValueError:
+                return self.send(400)
+            with lock:
+                if output:
+                    with open(output, "a") as f:
+                        f.write(json.dumps(request, separators=(",", ":")) + "\n")
+                for line in summarize(request):
+                    print(line, flush=True)
+            self.send(200)
+
+    return Handler
+
+def start_server(output: str = "", port: int = 0) -> http.server.ThreadingHTTPServer:
+    """Start the collector in a background thread"""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), make_handler(output, threading.Lock()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=4318)
+    parser.add_argument("--output", default="", help="append the received exports to this file")
+    parser.add_argument("--summarize", metavar="FILE", help="print the traces of an export file and exit")
+    args = parser.parse_args()
+
+    if args.summarize:
+        with open(args.summarize) as f:
+            for line in f:
+                if line.strip():
+                    print("\n".join(summarize(json.loads(line))))
+        return
+
+    server = start_server(args.output, args.port)
+    print(f"Collecting traces on http://127.0.0.1:{server.server_port}/v1/traces (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""yt-dlp extractor for the videos served by benchmarks/fixture_server.py.
+
+yt-dlp loads it as a plugin when the benchmarks directory is on sys.path.
+Like the YouTube extractor, it fetches a watch page, a player script that
+each extractor instance caches, and the video metadata.
+"""
+import re
+
+from yt_dlp.extractor.common import InfoExtractor
+
+class FixtureIE(InfoExtractor):
+    IE_NAME = 'fixture'
+    _VALID_URL = r'https?://(?:127\.0\.0\.1|localhost):\d+/watch/(?P<id>[\w-]+)'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._player_cache = {}
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        origin = re.match(r'https?://[^/]+', url).group(0)
+        webpage = self._download_webpage(url, video_id)
+        player_url = origin + self._search_regex(r'data-player="([^"]+)"', webpage, 'player url')
+        if player_url not in self._player_cache:
+            self._player_cache[player_url] = self._download_webpage(player_url, video_id, note='Downloading player')
+        
+        data = self._download_json(f'{origin}/api/{video_id}.json', video_id)
+        return {
+            'id': video_id,
+            'title': data['title'],
+            'duration': data['duration'],
+            'formats': [dict(f, url=origin + f.pop('path')) for f in data['formats']],
+        }
@@ -0,0 +1,131 @@
+"""Start the API with the app preloaded once and the workers forked from it.
+
+`uvicorn --workers N` starts each worker as a new interpreter, which imports
+FastAPI, yt-dlp and the extractor list again and compiles the extractor URL
+patterns again. This launcher does that once in the master process, binds
+the socket and forks the workers. They are ready in milliseconds and share
+the preloaded memory copy-on-write. Workers that die are replaced; SIGTERM or
+SIGINT stops them all.
+
+    python serve.py --host 0.0.0.0 --port 8080 --workers 4
+
+Background threads (job workers, sweeper) and the warm YoutubeDL instances
+are still started per worker, by the app's lifespan.
+"""
+import argparse
+import gc
+import os
+import shutil
+import signal
+import socket
+import sys
+import time
+import traceback
+
+import uvicorn
+
+def clear_metrics():
+    """Empty the metrics directory, which holds the files of the previous run's workers"""
+    path = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/metrics")  # the app's default
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+def preload():
+    """Import the app and warm everything that is the same in every worker"""
+    import app
+    app.warm_extractors()
+    # Objects that exist now are never collected; keeping them out of the GC's
+    # generations stops collections in the workers from writing to their pages
+    gc.freeze()
+    return app.app
+
+def bind(host: str, port: int) -> socket.socket:
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(asgi_app, sock: socket.socket, args) -> int:
+    """Serve requests in a forked worker until it is told to stop"""
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    config = uvicorn.Config(
+        asgi_app, proxy_headers=args.proxy_headers, forwarded_allow_ips=args.forwarded_allow_ips,
+        log_level=args.log_level, timeout_keep_alive=args.timeout_keep_alive,
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+    return 0
+
+class Supervisor:
+    """Forks the workers and replaces the ones that exit"""
+
+    def __init__(self, asgi_app, sock: socket.socket, args):
+        self.asgi_app = asgi_app
+        self.sock = sock
+        self.args = args
+        self.children = {}  # pid -> start time
+        self.stopping = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = run_worker(self.asgi_app, self.sock, self.args)
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.children[pid] = time.monotonic()
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+        for _ in range(self.args.workers):
+            self.spawn()
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = self.children.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}, restarting", file=sys.stderr)
+            # A worker that cannot start would otherwise be forked in a loop
+            if time.monotonic() - started < 1:
+                time.sleep(1)
+            self.spawn()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8080")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", "4")))
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--timeout-keep-alive", type=int, default=5)
+    parser.add_argument("--no-proxy-headers", dest="proxy_headers", action="store_false")
+    parser.add_argument("--forwarded-allow-ips", help="default: FORWARDED_ALLOW_IPS or 127.0.0.1, as in uvicorn")
+    args = parser.parse_args()
+
+    # Before the app is imported, which creates the master's metric files
+    clear_metrics()
+    asgi_app = preload()
+    sock = bind(args.host, args.port)
+    Supervisor(asgi_app, sock, args).run()
+
+if __name__ == "__main__":
+    main()